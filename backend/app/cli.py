@@ -0,0 +1,75 @@
+# backend/app/cli.py
+"""Mailbox export/import for backups, analytics and moving between environments.
+
+    python -m app.cli export --user me@example.com --format parquet --decrypt -o mailbox.parquet
+    python -m app.cli import --user me@example.com -i mailbox.ndjson
+"""
+import argparse
+import sys
+
+from app.database import SessionLocal
+from app.models import User
+from app.services import mailbox_io
+
+def _get_user(db, email: str) -> User:
+    user = db.query(User).filter(User.email == email).first()
+    if not user:
+        sys.exit(f"No user with email {email}")
+    return user
+
+def export_command(args):
+    db = SessionLocal()
+    try:
+        user = _get_user(db, args.user)
+        export = mailbox_io.export_parquet if args.format == "parquet" else mailbox_io.export_ndjson
+        out = open(args.output, "wb") if args.output != "-" else sys.stdout.buffer
+        try:
+            for chunk in export(db, user.id, decrypt=args.decrypt):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+    finally:
+        db.close()
+
+def import_command(args):
+    db = SessionLocal()
+    try:
+        user = _get_user(db, args.user)
+        if args.format == "parquet":
+            records = mailbox_io.read_parquet(args.input)
+            inserted = mailbox_io.import_records(db, user.id, records, batch_size=args.batch_size)
+        else:
+            with (open(args.input) if args.input != "-" else sys.stdin) as f:
+                inserted = mailbox_io.import_records(db, user.id, mailbox_io.read_ndjson(f), batch_size=args.batch_size)
+        print(f"Imported {inserted} emails for {user.email}", file=sys.stderr)
+    finally:
+        db.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="InboxGenie mailbox tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="stream a mailbox to NDJSON or Parquet")
+    exp.add_argument("--user", required=True, help="account email")
+    exp.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    exp.add_argument("--decrypt", action="store_true", help="write AI fields as plaintext")
+    exp.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    exp.set_defaults(func=export_command)
+
+    imp = sub.add_parser("import", help="bulk-load an exported mailbox")
+    imp.add_argument("--user", required=True, help="account email to import into")
+    imp.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    imp.add_argument("-i", "--input", default="-", help="input file (default: stdin, NDJSON only)")
+    imp.add_argument("--batch-size", type=int, default=mailbox_io.CHUNK_SIZE)
+    imp.set_defaults(func=import_command)
+
+    args = parser.parse_args(argv)
+    if args.format == "parquet" and not mailbox_io.parquet_available():
+        sys.exit("Parquet support requires pyarrow")
+    if args.command == "export" and args.format == "parquet" and args.output == "-" and sys.stdout.isatty():
+        sys.exit("Refusing to write Parquet to a terminal; use -o")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -37,3 +37,53 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 # Celery / Redis
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/0")
+
+# Shared Redis used for cross-process coordination (rate limiting etc.)
+REDIS_URL = os.getenv("REDIS_URL", CELERY_BROKER_URL)
+
+# Quotas: Gmail allows 250 quota units per user per second; Gemini is limited in requests per minute
+GMAIL_USER_QUOTA_PER_SECOND = float(os.getenv("GMAIL_USER_QUOTA_PER_SECOND", "250"))
+GEMINI_REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1"))
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "300"))
+
+# Near-duplicate reuse: emails whose SimHash fingerprints differ in at most this many of 64 bits
+# share one AI classification (0 = exact template match only, set NEAR_DUPLICATE_REUSE=false to disable).
+# Matches closer than NEAR_DUPLICATE_LSH_BANDS bits are always found, farther ones most of the time.
+NEAR_DUPLICATE_REUSE = os.getenv("NEAR_DUPLICATE_REUSE", "true").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "8"))
+NEAR_DUPLICATE_LSH_BANDS = int(os.getenv("NEAR_DUPLICATE_LSH_BANDS", "6"))
+
+# Embeddings / vector search ("hashing" needs only numpy; "sentence-transformers" runs a local CPU model)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "data/vectors")
+# Above this many vectors per user, search switches from an exact scan to a binary-code prefilter
+VECTOR_ANN_THRESHOLD = int(os.getenv("VECTOR_ANN_THRESHOLD", "50000"))
+
+# Speculative smart replies for IMPORTANT mail (cap = emails per user per day)
+SMART_REPLY_PRECOMPUTE = os.getenv("SMART_REPLY_PRECOMPUTE", "true").lower() == "true"
+SMART_REPLY_DAILY_CAP = int(os.getenv("SMART_REPLY_DAILY_CAP", "50"))
+
+# Email storage: hash partitions by user_id (Postgres only, fixed when the table is created) and retention
+EMAIL_PARTITIONS = int(os.getenv("EMAIL_PARTITIONS", "16"))
+TRASH_RETENTION_DAYS = int(os.getenv("TRASH_RETENTION_DAYS", "30"))
+ARCHIVE_RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", "0"))  # 0 keeps archived mail hot
+COLD_RETENTION_DAYS = int(os.getenv("COLD_RETENTION_DAYS", "365"))      # 0 keeps cold mail forever
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+
+# Celery queues: inbox sync interval and the queue-wait target for interactive tasks
+SYNC_INTERVAL_SECONDS = float(os.getenv("SYNC_INTERVAL_SECONDS", "300"))
+INTERACTIVE_SLO_SECONDS = float(os.getenv("INTERACTIVE_SLO_SECONDS", "2"))
+# Backlog AI tasks still unfinished after this long (lost, or out of retries) are queued again
+AI_REQUEUE_AFTER_SECONDS = float(os.getenv("AI_REQUEUE_AFTER_SECONDS", "7200"))
+
+# Gemini circuit breaker: open after this many failures (timeouts, 5xx) within the window, then probe again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_FAILURE_WINDOW_SECONDS = float(os.getenv("CIRCUIT_FAILURE_WINDOW_SECONDS", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# Latency-critical calls (auto/smart replies) send a second request if the first is slower than this
+GEMINI_HEDGING = os.getenv("GEMINI_HEDGING", "true").lower() == "true"
+GEMINI_HEDGE_AFTER_SECONDS = float(os.getenv("GEMINI_HEDGE_AFTER_SECONDS", "2"))
+# Threads per process for Gemini calls; above FastAPI's 40-thread pool for sync routes, plus hedges
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "64"))
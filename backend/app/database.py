@@ -1,6 +1,8 @@
 # backend/app/database.py
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.schema import CreateColumn, PrimaryKeyConstraint
 from app.config import DATABASE_URL
 
 engine = create_engine(DATABASE_URL, future=True)
@@ -13,3 +15,36 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def create_hash_partitions(table, partitions: int):
+    """Create the child tables of a hash-partitioned table right after the parent (Postgres only)"""
+    @event.listens_for(table, "after_create")
+    def _create_partitions(target, connection, **kw):
+        if connection.dialect.name != "postgresql":
+            return
+        for i in range(partitions):
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {target.name}_p{i} PARTITION OF {target.name} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {i})"
+            ))
+
+_ROWID_KEY_TABLES = set()
+
+def rowid_key_outside_postgres(table):
+    """SQLite can't autoincrement inside a composite primary key. The (id, user_id) key only exists
+    for partitioning, so there `id` becomes the rowid key and (id, user_id) stays unique for FKs."""
+    _ROWID_KEY_TABLES.add(table.name)
+
+@compiles(CreateColumn, "sqlite")
+def _sqlite_create_column(element, compiler, **kw):
+    column = element.element
+    if column.table.name in _ROWID_KEY_TABLES and column is column.table._autoincrement_column:
+        return f"{compiler.preparer.format_column(column)} INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT"
+    return compiler.visit_create_column(element, **kw)
+
+@compiles(PrimaryKeyConstraint, "sqlite")
+def _sqlite_primary_key(constraint, compiler, **kw):
+    if constraint.table.name in _ROWID_KEY_TABLES:
+        columns = ", ".join(compiler.preparer.quote(c.name) for c in constraint.columns)
+        return f"UNIQUE ({columns})"
+    return compiler.visit_primary_key_constraint(constraint, **kw)
@@ -0,0 +1,148 @@
+# backend/app/migrate.py
+"""One-off upgrade of a database created before emails was hash-partitioned.
+
+    python -m app.migrate
+    python -m app.migrate --keep-legacy   # leave the old table behind as emails_legacy
+
+Stop the API, workers and beat first, and run this before starting the new version: app.main only
+creates missing tables, it can't change existing ones. The script
+  1. renames an old emails table (primary key on id alone, message_id unique) to emails_legacy,
+  2. creates the current schema, including the emails partitions on Postgres,
+  3. copies the old rows over with updated_at backfilled from created_at and drops emails_legacy,
+  4. adds columns and indexes that later releases introduced to existing tables,
+  5. rebuilds what the old schema never stored: categories, fingerprints, label links and counters.
+Steps 1-4 run in one transaction on Postgres, so a failure leaves the database as it was. The
+script is safe to re-run; on an up-to-date database it only re-checks steps 4 and 5.
+"""
+import argparse
+import ast
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from app.database import Base, SessionLocal, engine
+from app.models import Email, User
+from app.services import counters, mailbox_io
+from app.utils.crypto import decrypt_data
+
+LEGACY_TABLE = "emails_legacy"
+
+def _is_legacy_emails(inspector) -> bool:
+    if not inspector.has_table("emails"):
+        return False
+    unique = {c["name"] for c in inspector.get_unique_constraints("emails")}
+    return "uq_emails_user_message" not in unique
+
+def _rename_legacy(conn):
+    conn.execute(text(f"ALTER TABLE emails RENAME TO {LEGACY_TABLE}"))
+    if conn.dialect.name == "postgresql":
+        # these names would clash with the ones the new table gets
+        conn.execute(text(f"ALTER INDEX IF EXISTS emails_pkey RENAME TO {LEGACY_TABLE}_pkey"))
+        seq = conn.scalar(text(f"SELECT pg_get_serial_sequence('{LEGACY_TABLE}', 'id')"))
+        if seq:
+            conn.execute(text(f"ALTER SEQUENCE {seq} RENAME TO {LEGACY_TABLE}_id_seq"))
+
+def _copy_legacy(conn, keep_legacy: bool) -> int:
+    legacy = {c["name"] for c in inspect(conn).get_columns(LEGACY_TABLE)}
+    columns = [c.name for c in Email.__table__.columns if c.name in legacy and c.name != "updated_at"]
+    updated = "COALESCE(updated_at, created_at)" if "updated_at" in legacy else "created_at"
+    skipped = conn.scalar(text(f"SELECT COUNT(*) FROM {LEGACY_TABLE} WHERE user_id IS NULL"))
+    if skipped:
+        print(f"Skipping {skipped} emails without a user_id; they can't be placed in a partition",
+              file=sys.stderr)
+    copied = conn.execute(text(
+        f"INSERT INTO emails ({', '.join(columns)}, updated_at) "
+        f"SELECT {', '.join(columns)}, {updated} FROM {LEGACY_TABLE} WHERE user_id IS NOT NULL"
+    )).rowcount
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "SELECT setval(pg_get_serial_sequence('emails', 'id'), COALESCE((SELECT MAX(id) FROM emails), 0) + 1, false)"
+        ))
+    if not keep_legacy:
+        conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    return copied
+
+def _add_missing_columns(conn):
+    """Columns added since a table was created; all of them are nullable or have defaults in SQL"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if not column.nullable and column.server_default is None:
+                sys.exit(f"Can't add NOT NULL column {table.name}.{column.name} without a default")
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            print(f"Added {table.name}.{column.name}", file=sys.stderr)
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def upgrade_schema(keep_legacy: bool = False) -> int:
+    """Steps 1-4. Returns the number of emails copied from a legacy table."""
+    with engine.begin() as conn:
+        legacy = _is_legacy_emails(inspect(conn))
+        if legacy:
+            _rename_legacy(conn)
+        Base.metadata.create_all(conn)
+        copied = _copy_legacy(conn, keep_legacy) if legacy else 0
+        _add_missing_columns(conn)
+        conn.execute(
+            text("UPDATE emails SET updated_at = COALESCE(created_at, :now) WHERE updated_at IS NULL"),
+            {"now": datetime.utcnow()},
+        )
+    return copied
+
+def _backfill_categories(db, user_id: int, chunk_size: int = mailbox_io.CHUNK_SIZE):
+    """category mirrors the stored classification; rows classified before it existed have none.
+    classification_source stays empty, so these labels are never reused for near-duplicates."""
+    last_id = 0
+    while True:
+        rows = db.query(Email).filter(
+            Email.user_id == user_id,
+            Email.id > last_id,
+            Email.category.is_(None),
+            Email.ai_classification_enc.isnot(None),
+        ).order_by(Email.id).limit(chunk_size).all()
+        if not rows:
+            return
+        for email in rows:
+            try:
+                result = ast.literal_eval(decrypt_data(email.ai_classification_enc))
+                email.category = result["label"]
+                email.updated_at = Email.updated_at  # keep the backfilled value
+            except Exception as e:
+                print(f"Unreadable classification on email {email.id}: {e}", file=sys.stderr)
+        db.commit()
+        last_id = rows[-1].id
+
+def rebuild_derived(db, user_id: int):
+    """Step 5 for one user"""
+    _backfill_categories(db, user_id)
+    mailbox_io.index_emails(db, user_id)
+    counters.rebuild(db, user_id)
+    db.commit()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.migrate", description="Upgrade an existing InboxGenie database")
+    parser.add_argument("--keep-legacy", action="store_true",
+                        help=f"keep the old emails table as {LEGACY_TABLE} after copying")
+    args = parser.parse_args(argv)
+
+    copied = upgrade_schema(keep_legacy=args.keep_legacy)
+    if copied:
+        print(f"Copied {copied} emails into the partitioned table", file=sys.stderr)
+    db = SessionLocal()
+    try:
+        for (user_id,) in db.query(User.id).all():
+            rebuild_derived(db, user_id)
+        print("Rebuilt categories, fingerprints, label links and counters", file=sys.stderr)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
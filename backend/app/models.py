@@ -1,8 +1,12 @@
 # backend/app/models.py
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Text, DateTime, Boolean, LargeBinary,
+    ForeignKey, ForeignKeyConstraint, UniqueConstraint, Index, text,
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from app.database import Base
+from app.config import EMAIL_PARTITIONS
+from app.database import Base, create_hash_partitions, rowid_key_outside_postgres
 
 class User(Base):
     __tablename__ = "users"
@@ -14,21 +18,138 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     emails = relationship("Email", back_populates="owner", cascade="all, delete-orphan")
+    outbox = relationship("OutboxMessage", back_populates="owner", cascade="all, delete-orphan")
 
 class Email(Base):
+    """Hot mail. On Postgres the table is hash-partitioned by user_id, so every per-user
+    query touches one partition; unique keys therefore include user_id."""
     __tablename__ = "emails"
-    id = Column(Integer, primary_key=True, index=True)
-    message_id = Column(String(255), unique=True, index=True, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", name="uq_emails_user_message"),
+        Index("ix_emails_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_emails_user_status_updated", "user_id", "status", "updated_at"),
+        # backlog polling only ever looks at the (small) set of unclassified rows
+        Index("ix_emails_unclassified", "user_id", "id",
+              postgresql_where=text("ai_classification_enc IS NULL"),
+              sqlite_where=text("ai_classification_enc IS NULL")),
+        Index("ix_emails_unembedded", "user_id", "id",
+              postgresql_where=text("embedded_with IS NULL"),
+              sqlite_where=text("embedded_with IS NULL")),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    message_id = Column(String(255), nullable=False)
     sender = Column(String(255))
     subject = Column(String(512))
     snippet = Column(Text)
     labels = Column(String(255))
     ai_summary_enc = Column(Text, nullable=True)        # encrypted summary
     ai_classification_enc = Column(Text, nullable=True) # encrypted classification
+    ai_replies_enc = Column(Text, nullable=True)        # encrypted precomputed replies (JSON)
+    ai_queued_at = Column(DateTime, nullable=True)      # when backlog classify/summarize tasks were last queued
     is_spam = Column(Boolean, default=False)
     is_read = Column(Boolean, default=False)
     status = Column(String(50), default="inbox")  # inbox, archived, trashed
+    category = Column(String(20), nullable=True)        # AI label (IMPORTANT, PROMOTION, ...), for counters
+    classification_source = Column(String(16), nullable=True)  # "model" or "heuristic"; only model labels are reused
+    simhash = Column(BigInteger, nullable=True)         # 64-bit SimHash of subject + snippet (signed)
+    embedded_with = Column(String(64), nullable=True)   # embedder key of the row's vector, None = not embedded
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # drives retention
 
     owner = relationship("User", back_populates="emails")
+    lsh_bands = relationship("EmailLshBand", cascade="all, delete-orphan", passive_deletes=True)
+    label_links = relationship("EmailLabel", cascade="all, delete-orphan", passive_deletes=True)
+
+class EmailLshBand(Base):
+    """One band of an email's SimHash; near-duplicates share at least one (band, value) pair"""
+    __tablename__ = "email_lsh_bands"
+    __table_args__ = (
+        ForeignKeyConstraint(["email_id", "user_id"], ["emails.id", "emails.user_id"], ondelete="CASCADE"),
+        Index("ix_email_lsh_bands_lookup", "user_id", "band", "value"),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+    email_id = Column(Integer, primary_key=True)
+    band = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False)
+
+class Label(Base):
+    """A Gmail label of one user; system labels use their name as id (INBOX, UNREAD, CATEGORY_SOCIAL...)"""
+    __tablename__ = "labels"
+    __table_args__ = (UniqueConstraint("user_id", "gmail_label_id", name="uq_labels_user_gmail_id"),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    gmail_label_id = Column(String(255), nullable=False)
+    name = Column(String(255), nullable=False)
+    type = Column(String(20), default="user")  # system, user
+
+class EmailLabel(Base):
+    __tablename__ = "email_labels"
+    __table_args__ = (
+        ForeignKeyConstraint(["email_id", "user_id"], ["emails.id", "emails.user_id"], ondelete="CASCADE"),
+        Index("ix_email_labels_user_label", "user_id", "label_id"),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+    email_id = Column(Integer, primary_key=True)
+    label_id = Column(Integer, ForeignKey("labels.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+
+    label = relationship("Label")
+
+class MailboxCounter(Base):
+    """Per-user totals and unread counts, kept up to date incrementally (kind: label, category, status)"""
+    __tablename__ = "mailbox_counters"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    kind = Column(String(20), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    unread = Column(Integer, default=0, nullable=False)
+
+class ColdEmail(Base):
+    """Trashed/archived mail past retention: compressed snippet, no AI artefacts besides the label"""
+    __tablename__ = "emails_cold"
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", name="uq_emails_cold_user_message"),
+        Index("ix_emails_cold_moved", "moved_at"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=False)  # id the row had in emails
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    message_id = Column(String(255), nullable=False)
+    sender = Column(String(255))
+    subject = Column(String(512))
+    snippet_z = Column(LargeBinary)          # zlib-compressed snippet
+    labels = Column(String(255))
+    ai_classification_enc = Column(Text, nullable=True)
+    is_spam = Column(Boolean, default=False)
+    is_read = Column(Boolean, default=False)
+    status = Column(String(50))
+    created_at = Column(DateTime)
+    moved_at = Column(DateTime, default=datetime.utcnow)
+
+create_hash_partitions(Email.__table__, EMAIL_PARTITIONS)
+rowid_key_outside_postgres(Email.__table__)
+create_hash_partitions(EmailLshBand.__table__, EMAIL_PARTITIONS)
+create_hash_partitions(EmailLabel.__table__, EMAIL_PARTITIONS)
+
+class OutboxMessage(Base):
+    __tablename__ = "outbox"
+    __table_args__ = (UniqueConstraint("user_id", "idempotency_key", name="uq_outbox_user_idempotency"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    idempotency_key = Column(String(255), nullable=False)
+    rfc822_message_id = Column(String(255), nullable=False)  # Message-ID header, used to detect an earlier send
+    to_addr = Column(String(512), nullable=False)
+    subject = Column(String(512), nullable=False)
+    body_enc = Column(Text, nullable=False)             # encrypted body
+    status = Column(String(50), default="pending", index=True)  # pending, sending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)   # when a scheduled retry is due; None = not retried yet
+    last_error = Column(Text, nullable=True)
+    gmail_message_id = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    owner = relationship("User", back_populates="outbox")
@@ -1,8 +1,14 @@
 # backend/app/routes/ai.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
+from sqlalchemy.orm import Session
 from typing import List, Optional
-from app.services.ai_service import ai_service
+from app.database import get_db
+from app.models import User, Email
+from app.services.ai_service import ai_service, gemini_breaker
+from app.services.reply_precompute import load_replies
+from app.services.rate_limiter import GEMINI_BUCKET, rate_limiter
+from app.utils import metrics
 
 router = APIRouter()
 
@@ -21,6 +27,20 @@ class EmailIn(BaseModel):
 class AutoReplyIn(BaseModel):
     original_email: str
     context: Optional[str] = ""
+    email_id: Optional[str] = None  # Gmail message id, lets precomputed replies be served
+
+class SmartReplyIn(BaseModel):
+    text: str
+    email_id: Optional[str] = None  # Gmail message id, lets precomputed replies be served
+
+def _precomputed_replies(db: Session, email_id: Optional[str]):
+    if not email_id:
+        return None
+    user = db.query(User).first()
+    if not user:
+        return None
+    email = db.query(Email).filter(Email.message_id == email_id, Email.user_id == user.id).first()
+    return load_replies(email)
 
 @router.post("/classify")
 def classify_email(email_data: EmailIn):
@@ -64,26 +84,42 @@ def rewrite_tone(tone_input: ToneIn):
         raise HTTPException(status_code=500, detail=f"Tone rewriting failed: {str(e)}")
 
 @router.post("/auto-reply")
-def generate_auto_reply(auto_reply_input: AutoReplyIn):
+def generate_auto_reply(auto_reply_input: AutoReplyIn, db: Session = Depends(get_db)):
     """Generate an automatic reply based on original email"""
     try:
+        precomputed = None if auto_reply_input.context else _precomputed_replies(db, auto_reply_input.email_id)
+        if precomputed and precomputed.get("auto_reply"):
+            return {
+                "success": True,
+                "reply": precomputed["auto_reply"],
+                "precomputed": True,
+                "message": "Auto-reply generated successfully"
+            }
         reply = ai_service.generate_auto_reply(auto_reply_input.original_email, auto_reply_input.context)
         return {
             "success": True,
             "reply": reply,
+            "precomputed": False,
             "message": "Auto-reply generated successfully"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Auto-reply generation failed: {str(e)}")
 
 @router.post("/smart-reply")
-def generate_smart_replies(text_input: TextIn):
+def generate_smart_replies(smart_reply_input: SmartReplyIn, db: Session = Depends(get_db)):
     """Generate multiple smart reply options"""
     try:
-        replies = ai_service.generate_smart_reply(text_input.text)
+        precomputed = _precomputed_replies(db, smart_reply_input.email_id)
+        if precomputed and precomputed.get("smart_replies"):
+            replies = precomputed["smart_replies"]
+            is_precomputed = True
+        else:
+            replies = ai_service.generate_smart_reply(smart_reply_input.text)
+            is_precomputed = False
         return {
             "success": True,
             "replies": replies,
+            "precomputed": is_precomputed,
             "message": f"Generated {len(replies)} smart reply options"
         }
     except Exception as e:
@@ -91,21 +127,57 @@ def generate_smart_replies(text_input: TextIn):
 
 @router.get("/health")
 def ai_health_check():
-    """Check if AI service is working"""
+    """Check if AI service is working: Gemini configuration, circuit breaker state and throttling"""
+    breaker = gemini_breaker.snapshot()
+    cooldown = rate_limiter.cooldown_seconds(GEMINI_BUCKET)
+    gemini_available = ai_service.client is not None
+    if not gemini_available:
+        message = "Gemini is not configured; using heuristic fallbacks"
+    elif breaker["state"] != "closed":
+        message = f"Gemini circuit is {breaker['state']}; using heuristic fallbacks"
+    elif cooldown:
+        message = f"Gemini is throttling requests; backing off for {cooldown:g}s"
+    else:
+        message = "AI service is operational"
+    return {
+        "success": True,
+        "provider": "gemini",
+        "gemini_available": gemini_available,
+        "circuit": breaker,
+        "rate_limit_cooldown_seconds": cooldown,
+        "message": message
+    }
+
+@router.get("/rate-limits")
+def get_rate_limits():
+    """Show the shared Gmail/Gemini token buckets and any active backoff"""
+    return {
+        "success": True,
+        "buckets": rate_limiter.snapshot()
+    }
+
+@router.get("/metrics")
+def get_ai_metrics():
+    """Counters for AI work, e.g. model calls saved by near-duplicate reuse"""
+    counters = metrics.counters()
+    hits = counters.get("ai.classify.near_duplicate_hits", 0)
+    calls = counters.get("ai.classify.model_calls", 0)
     return {
         "success": True,
-        "provider": ai_service.provider,
-        "openai_available": ai_service.client is not None,
-        "message": "AI service is operational"
+        "counters": counters,
+        "classify_calls_saved": hits,
+        "classify_reuse_rate": round(hits / (hits + calls), 4) if hits + calls else 0.0
     }
 
 @router.post("/process-emails")
 def process_emails_async():
     """Trigger async processing of all unprocessed emails"""
-    from celery_app import process_new_emails_async
+    from celery_app import QUEUE_INTERACTIVE, process_new_emails_async
     
     try:
-        task = process_new_emails_async.delay()
+        # the user is waiting on this run, so it and the tasks it fans out skip the bulk backlog
+        task = process_new_emails_async.apply_async(kwargs={"queue": QUEUE_INTERACTIVE},
+                                                    queue=QUEUE_INTERACTIVE, priority=0)
         return {
             "success": True,
             "task_id": task.id,
@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+import logging
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import User, Email
+from app.database import get_db, SessionLocal
+from app.models import User, Email, OutboxMessage
+from app.services import outbox_service
+from app.services import counters, mailbox_io
+from app.services.embeddings import get_embedder, email_text
 from app.services.gmail_service import GmailService
+from app.services.labels import remove_label, set_status
+from app.services.vector_index import VectorIndex
+from app.services.rate_limiter import RateLimited
+
+logger = logging.getLogger("inboxgenie.gmail")
 
 router = APIRouter()
 
@@ -21,12 +32,95 @@ def get_inbox(db: Session = Depends(get_db)):
     gmail_service = GmailService(user)
     
     # Fetch and store new emails, then return all emails for the user
-    gmail_service.fetch_and_store_inbox(db, user, max_results=25)
+    try:
+        gmail_service.fetch_and_store_inbox(db, user, max_results=25)
+    except RateLimited as e:
+        raise HTTPException(
+            status_code=429,
+            detail=f"Gmail quota exhausted, retry in {e.retry_after:.1f}s",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
     
     # Return all emails from the database for this user
     emails = user.emails
     return {"emails": emails}
 
+def _ranked_emails(db: Session, user: User, hits):
+    """Load the emails for (email_id, score) hits, keeping the ranking"""
+    rows = db.query(Email).filter(Email.id.in_([eid for eid, _ in hits]), Email.user_id == user.id).all()
+    by_id = {row.id: row for row in rows}
+    return [{"score": round(score, 4), "email": by_id[eid]} for eid, score in hits if eid in by_id]
+
+@router.get("/counts")
+def get_counts(db: Session = Depends(get_db)):
+    """Total and unread counts per label, category and status for sidebar badges"""
+    user = db.query(User).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
+
+    return {"success": True, "counts": counters.get_counts(db, user.id)}
+
+@router.get("/similar/{email_id}")
+def similar_emails(email_id: str, k: int = 10, db: Session = Depends(get_db)):
+    """Emails most similar in meaning to the given one ("more like this")"""
+    user = db.query(User).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
+
+    email = db.query(Email).filter(Email.message_id == email_id, Email.user_id == user.id).first()
+    if not email:
+        raise HTTPException(status_code=404, detail="Email not found")
+
+    embedder = get_embedder()
+    index = VectorIndex(user.id, embedder)
+    vector = index.vector_for(email.id)
+    if vector is None:
+        # not embedded yet: embed on the fly instead of waiting for the background task
+        vector = embedder.embed([email_text(email)])[0]
+
+    hits = index.search(vector, k=max(1, min(k, 100)), exclude={email.id})
+    return {"email_id": email_id, "results": _ranked_emails(db, user, hits)}
+
+@router.get("/semantic-search")
+def semantic_search(q: str, k: int = 10, db: Session = Depends(get_db)):
+    """Search emails by meaning rather than exact keywords"""
+    user = db.query(User).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+
+    embedder = get_embedder()
+    hits = VectorIndex(user.id, embedder).search(embedder.embed([q])[0], k=max(1, min(k, 100)))
+    return {"query": q, "results": _ranked_emails(db, user, hits)}
+
+@router.get("/export")
+def export_mailbox(format: str = "ndjson", decrypt: bool = False, db: Session = Depends(get_db)):
+    """Stream the whole mailbox as NDJSON or Parquet without loading it into memory"""
+    user = db.query(User).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
+    if format not in ("ndjson", "parquet"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'parquet'")
+    if format == "parquet" and not mailbox_io.parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export requires pyarrow")
+
+    user_id = user.id
+    export = mailbox_io.export_parquet if format == "parquet" else mailbox_io.export_ndjson
+
+    def stream():
+        # the request session is closed before streaming starts, so the export owns its own
+        export_db = SessionLocal()
+        try:
+            yield from export(export_db, user_id, decrypt=decrypt)
+        finally:
+            export_db.close()
+
+    media_type = "application/vnd.apache.parquet" if format == "parquet" else "application/x-ndjson"
+    filename = f"mailbox-{user_id}.{'parquet' if format == 'parquet' else 'ndjson'}"
+    return StreamingResponse(stream(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
 @router.post("/archive/{email_id}")
 def archive_email(email_id: str, db: Session = Depends(get_db)):
     """Archive an email"""
@@ -39,7 +133,9 @@ def archive_email(email_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Email not found")
     
     # Update email status to archived
-    email.status = "archived"
+    before = counters.snapshot(email)
+    set_status(db, email, "archived")
+    counters.apply_change(db, user.id, before, counters.snapshot(email))
     db.commit()
     
     return {"success": True, "message": "Email archived successfully"}
@@ -56,7 +152,9 @@ def trash_email(email_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Email not found")
     
     # Update email status to trashed
-    email.status = "trashed"
+    before = counters.snapshot(email)
+    set_status(db, email, "trashed")
+    counters.apply_change(db, user.id, before, counters.snapshot(email))
     db.commit()
     
     return {"success": True, "message": "Email moved to trash successfully"}
@@ -73,7 +171,9 @@ def move_to_inbox(email_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Email not found")
     
     # Update email status to inbox
-    email.status = "inbox"
+    before = counters.snapshot(email)
+    set_status(db, email, "inbox")
+    counters.apply_change(db, user.id, before, counters.snapshot(email))
     db.commit()
     
     return {"success": True, "message": "Email moved to inbox successfully"}
@@ -90,66 +190,63 @@ def mark_email_read(email_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Email not found")
     
     # Mark email as read
+    before = counters.snapshot(email)
     email.is_read = True
+    remove_label(email, "UNREAD")
+    counters.apply_change(db, user.id, before, counters.snapshot(email))
     db.commit()
     
     return {"success": True, "message": "Email marked as read successfully"}
 
-@router.post("/send")
-def send_email(email_data: dict, db: Session = Depends(get_db)):
-    """Send an email via Gmail API"""
+@router.post("/send", status_code=202)
+def send_email(email_data: dict, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Queue an email for delivery; a Celery worker sends it via the Gmail API.
+
+    Clients may pass an Idempotency-Key header (or "idempotency_key" field) so that a
+    retried request returns the original outbox entry instead of sending twice.
+    """
+    from celery_app import send_outbox_message
+
     user = db.query(User).first()
     if not user:
         raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
-    
+
+    # Extract email data
+    to = email_data.get("to", "")
+    subject = email_data.get("subject", "")
+    body = email_data.get("body", "")
+
+    if not to or not subject or not body:
+        raise HTTPException(status_code=400, detail="Missing required fields: to, subject, body")
+
+    key = idempotency_key or email_data.get("idempotency_key")
     try:
-        gmail_service = GmailService(user)
-        
-        # Extract email data
-        to = email_data.get("to", "")
-        subject = email_data.get("subject", "")
-        body = email_data.get("body", "")
-        
-        if not to or not subject or not body:
-            raise HTTPException(status_code=400, detail="Missing required fields: to, subject, body")
-        
-        # Create email message
-        import base64
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
-        message = MIMEMultipart()
-        message['to'] = to
-        message['subject'] = subject
-        message.attach(MIMEText(body, 'plain'))
-        
-        # Encode the message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-        
-        # Send the email
-        result = gmail_service.send_raw_message(raw_message)
-        
-        # Store sent email in database for reference
-        sent_email = Email(
-            message_id=result.get('id', ''),
-            user_id=user.id,
-            sender=user.email,
-            subject=f"Sent: {subject}",
-            snippet=f"To: {to}",
-            labels="SENT",
-            status="sent",
-            is_read=True
-        )
-        db.add(sent_email)
-        db.commit()
-        
-        return {
-            "success": True, 
-            "message": "Email sent successfully",
-            "message_id": result.get('id', ''),
-            "to": to,
-            "subject": subject
-        }
-        
+        row, created = outbox_service.enqueue_message(db, user, to, subject, body, idempotency_key=key)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to send email: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue email: {str(e)}")
+
+    if created:
+        try:
+            send_outbox_message.delay(row.id)
+        except Exception as e:
+            # the row is persisted; the periodic dispatcher will pick it up
+            logger.warning(f"Could not enqueue outbox {row.id}: {e}")
+
+    return {
+        "success": True,
+        "message": "Email queued for delivery" if created else "Email already queued",
+        **outbox_service.serialize(row),
+    }
+
+@router.get("/outbox/{outbox_id}")
+def get_outbox_status(outbox_id: int, db: Session = Depends(get_db)):
+    """Delivery status of a queued email"""
+    user = db.query(User).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="No user found in the database. Please login first.")
+
+    row = db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id, OutboxMessage.user_id == user.id).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Outbox message not found")
+
+    return {"success": True, **outbox_service.serialize(row)}
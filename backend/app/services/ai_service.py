@@ -2,8 +2,14 @@
 import os
 import logging
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Dict, List
-from app.config import GEMINI_API_KEY
+from app.config import GEMINI_API_KEY, GEMINI_HEDGING, GEMINI_HEDGE_AFTER_SECONDS, GEMINI_POOL_SIZE
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.rate_limiter import rate_limiter, RateLimited, throttle_status, GEMINI_BUCKET
+from app.utils import metrics
 
 logger = logging.getLogger("inboxgenie.ai")
 
@@ -19,6 +25,53 @@ def get_gemini_client(api_key):
     genai.configure(api_key=api_key)
     return genai.GenerativeModel('gemini-2.5-flash')
 
+# Seconds each operation waits for Gemini before giving up and falling back; interactive ones get less
+OPERATION_DEADLINES = {
+    "classify": 10.0,
+    "summarize": 20.0,
+    "rewrite": 30.0,
+    "auto_reply": 8.0,
+    "smart_reply": 6.0,
+}
+DEFAULT_DEADLINE = 15.0
+# A user is waiting on these, so a slow first request is raced against a second one
+HEDGED_OPERATIONS = {"auto_reply", "smart_reply"}
+
+gemini_breaker = CircuitBreaker("gemini")
+# Bounds how many Gemini calls run at once per process. Abandoned calls keep their thread until the
+# request_options timeout (the operation's deadline) ends them, so size this above caller concurrency.
+_executor = ThreadPoolExecutor(max_workers=GEMINI_POOL_SIZE, thread_name_prefix="gemini")
+
+class GeminiBusy(RateLimited):
+    """No pool thread became free in time. A local overload, not a Gemini failure: the breaker
+    ignores it, and like throttling it makes callers fall back or retry later."""
+    def __init__(self, operation: str, waited: float):
+        Exception.__init__(self, f"No free Gemini worker thread for {operation} within {waited:g}s")
+        self.bucket = "gemini-pool"
+        self.retry_after = 1.0
+
+class _PoolCall:
+    """One request submitted to the pool; records when a thread actually starts it"""
+    def __init__(self, fn, *args):
+        self.started = threading.Event()
+        self.started_at = None
+        self.future = _executor.submit(self._run, fn, *args)
+
+    def _run(self, fn, *args):
+        self.started_at = time.monotonic()
+        self.started.set()
+        return fn(*args)
+
+def _is_outage(exc: Exception) -> bool:
+    """Timeouts, connection errors and 5xx count against the breaker; 4xx means Gemini answered.
+    Throttling statuses (429/503) are handled before this is consulted."""
+    resp = getattr(exc, "resp", None)
+    status = getattr(resp, "status", None) if resp is not None else getattr(exc, "code", None)
+    try:
+        return not 400 <= int(status) < 500
+    except (TypeError, ValueError):
+        return True
+
 class AIService:
     def __init__(self):
         self.api_key = GEMINI_API_KEY
@@ -27,28 +80,125 @@ class AIService:
         else:
             self.client = None
 
-    def classify(self, text: str) -> Dict:
-        """Classify email into categories: IMPORTANT, PROMOTION, GENERAL, SPAM"""
+    def _generate(self, prompt: str, operation: str) -> str:
+        """Call Gemini through the circuit breaker and the shared rate limiter.
+
+        Raises CircuitOpen (a RateLimited) without calling Gemini while the circuit is open,
+        RateLimited when throttled, TimeoutError once the operation's deadline has passed and
+        GeminiBusy when this process has no free thread to make the call.
+        """
+        deadline = OPERATION_DEADLINES.get(operation, DEFAULT_DEADLINE)
+        probe = gemini_breaker.allow(probe_seconds=deadline)
+        try:
+            rate_limiter.acquire_gemini()
+        except Exception:
+            if probe:
+                gemini_breaker.release_probe()  # the probe never reached Gemini
+            raise
+        hedge = GEMINI_HEDGING and operation in HEDGED_OPERATIONS and not probe
+        try:
+            text = self._call_with_deadline(prompt, operation, deadline, hedge)
+        except Exception as e:
+            status = throttle_status(e)
+            if status:
+                # 503 is Gemini being unavailable: back off like a 429, and count it as an outage too
+                if status == 503:
+                    gemini_breaker.record_failure()
+                elif probe:
+                    gemini_breaker.release_probe()
+                delay = rate_limiter.report_throttled(GEMINI_BUCKET)
+                raise RateLimited(GEMINI_BUCKET, delay) from e
+            if isinstance(e, GeminiBusy):
+                pass  # never reached Gemini; says nothing about its health
+            elif _is_outage(e):
+                gemini_breaker.record_failure()
+            else:
+                gemini_breaker.record_success()
+            raise
+        gemini_breaker.record_success()
+        rate_limiter.report_success(GEMINI_BUCKET)
+        return text
+
+    def _call(self, prompt: str, timeout: float) -> str:
+        response = self.client.generate_content(prompt, request_options={"timeout": timeout})
+        return response.text.strip()
+
+    def _call_with_deadline(self, prompt: str, operation: str, deadline: float, hedge: bool) -> str:
+        """Run the request in the pool and stop waiting `deadline` seconds after it started.
+
+        Time spent waiting for a free thread doesn't count against the deadline; if none frees up
+        within it the call is dropped with GeminiBusy. When hedging, a second identical request
+        starts if the first has not answered within GEMINI_HEDGE_AFTER_SECONDS; whichever
+        succeeds first wins.
+        """
+        primary = _PoolCall(self._call, prompt, deadline)
+        if not primary.started.wait(timeout=deadline) and primary.future.cancel():
+            metrics.incr(f"ai.{operation}.pool_busy")
+            raise GeminiBusy(operation, deadline)
+        primary.started.wait()
+        calls = [primary]
+        if hedge:
+            done, _ = wait([primary.future], timeout=GEMINI_HEDGE_AFTER_SECONDS)
+            if not done:
+                try:
+                    rate_limiter.acquire_gemini()
+                    calls.append(_PoolCall(self._call, prompt, deadline - GEMINI_HEDGE_AFTER_SECONDS))
+                    metrics.incr(f"ai.{operation}.hedged")
+                except RateLimited:
+                    pass  # no spare quota for a second request; keep waiting on the first
+        ends_at = primary.started_at + deadline
+        pending = {call.future for call in calls}
+        error = None
+        while pending:
+            remaining = ends_at - time.monotonic()
+            done, pending = wait(pending, timeout=max(0.0, remaining), return_when=FIRST_COMPLETED)
+            if not done:
+                # a hedge still queued is dropped; running calls end at their request timeout
+                for future in pending:
+                    future.cancel()
+                metrics.incr(f"ai.{operation}.timeouts")
+                raise TimeoutError(f"Gemini {operation} exceeded its {deadline:g}s deadline")
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def classify(self, text: str, fallback_on_limit: bool = True) -> Dict:
+        """Classify email into categories: IMPORTANT, PROMOTION, GENERAL, SPAM.
+
+        With fallback_on_limit=False a rate-limited call raises RateLimited instead of
+        degrading to the heuristic, so background tasks can retry later. "source" in the
+        result says whether the model ("model") or the heuristic ("heuristic") answered.
+        """
         if _GEMINI_AVAILABLE and self.client:
             prompt = f"""Analyze the email content and classify it into one of these categories: IMPORTANT, PROMOTION, GENERAL, SPAM.\nReturn ONLY a JSON object with 'label' and 'score' fields. Example: {{\"label\": \"IMPORTANT\", \"score\": 0.95}}\n\nEmail:\nSubject: {text.get('subject', 'No subject')}\nContent: {text.get('content', text.get('snippet', ''))}\n"""
             try:
-                response = self.client.generate_content(prompt)
-                content = response.text.strip()
+                content = self._generate(prompt, "classify")
                 try:
                     result = json.loads(content)
-                    return {"label": result.get("label", "GENERAL"), "score": result.get("score", 0.5)}
+                    result = {"label": result.get("label", "GENERAL"), "score": result.get("score", 0.5)}
                 except json.JSONDecodeError:
                     if "IMPORTANT" in content.upper():
-                        return {"label": "IMPORTANT", "score": 0.8}
+                        result = {"label": "IMPORTANT", "score": 0.8}
                     elif "PROMOTION" in content.upper():
-                        return {"label": "PROMOTION", "score": 0.8}
+                        result = {"label": "PROMOTION", "score": 0.8}
                     elif "SPAM" in content.upper():
-                        return {"label": "SPAM", "score": 0.8}
+                        result = {"label": "SPAM", "score": 0.8}
                     else:
-                        return {"label": "GENERAL", "score": 0.6}
+                        result = {"label": "GENERAL", "score": 0.6}
+                return {**result, "source": "model"}
+            except RateLimited as e:
+                if not fallback_on_limit:
+                    raise
+                logger.warning(f"{e}; falling back to heuristic classification.")
             except Exception as e:
                 logger.exception(f"Gemini classify failed: {e}; falling back to heuristic.")
-        # Fallback heuristic classification
+        return {**self._heuristic_classification(text), "source": "heuristic"}
+
+    def _heuristic_classification(self, text) -> Dict:
         text_str = str(text).lower()
         if any(word in text_str for word in ["unsubscribe", "sale", "promo", "discount", "offer", "deal"]):
             return {"label": "PROMOTION", "score": 0.9}
@@ -58,13 +208,16 @@ class AIService:
             return {"label": "SPAM", "score": 0.95}
         return {"label": "GENERAL", "score": 0.6}
 
-    def summarize(self, text: str) -> str:
+    def summarize(self, text: str, fallback_on_limit: bool = True) -> str:
         """Generate a concise summary of the email content"""
         if _GEMINI_AVAILABLE and self.client:
             prompt = f"""You are an email summarizer. Provide a concise 1-2 sentence summary that captures the main points and action items. Be specific and actionable. Summarize this email:\n\n{text}\n"""
             try:
-                response = self.client.generate_content(prompt)
-                return response.text.strip()
+                return self._generate(prompt, "summarize")
+            except RateLimited as e:
+                if not fallback_on_limit:
+                    raise
+                logger.warning(f"{e}; falling back to truncation.")
             except Exception as e:
                 logger.exception(f"Gemini summarize failed: {e}; falling back to truncation.")
         # Fallback: truncate to first 200 characters
@@ -84,8 +237,9 @@ class AIService:
             instruction = tone_instructions.get(tone.lower(), "professional")
             enhanced_prompt = f"""You are an expert email writer. Rewrite and expand the following email content in a {instruction} tone.\nOriginal content: {text}\nGenerate a complete, well-structured email:\n"""
             try:
-                response = self.client.generate_content(enhanced_prompt)
-                return response.text.strip()
+                return self._generate(enhanced_prompt, "rewrite")
+            except RateLimited as e:
+                logger.warning(f"{e}; falling back to simple formatting.")
             except Exception as e:
                 logger.exception(f"Gemini rewrite failed: {e}; falling back to simple formatting.")
         # Fallback: simple tone adjustments
@@ -97,25 +251,35 @@ class AIService:
             return f"Hi there!\n\n{text}\n\nBest regards!"
         return text
 
-    def generate_auto_reply(self, original_email: str, context: str = "") -> str:
-        """Generate an automatic reply based on the original email"""
+    def generate_auto_reply(self, original_email: str, context: str = "", fallback: bool = True) -> str:
+        """Generate an automatic reply based on the original email.
+
+        With fallback=False any model failure (or a missing client) raises instead of returning
+        the generic reply, so precomputed replies only ever hold real model output.
+        """
         if _GEMINI_AVAILABLE and self.client:
             prompt = f"""You are an AI assistant that generates appropriate email replies. Create a professional, helpful response that acknowledges the original message and provides relevant information or next steps. Keep it concise (2-3 sentences).\n\nEmail:\n{original_email}\n\nContext:\n{context}\n"""
             try:
-                response = self.client.generate_content(prompt)
-                return response.text.strip()
+                return self._generate(prompt, "auto_reply")
+            except RateLimited as e:
+                if not fallback:
+                    raise
+                logger.warning(f"{e}; falling back to generic response.")
             except Exception as e:
+                if not fallback:
+                    raise
                 logger.exception(f"Gemini auto-reply failed: {e}; falling back to generic response.")
+        elif not fallback:
+            raise RuntimeError("Gemini is not configured")
         # Fallback: generic acknowledgment
         return "Thank you for your email. I have received your message and will get back to you as soon as possible."
 
-    def generate_smart_reply(self, original_email: str) -> List[str]:
-        """Generate multiple smart reply options"""
+    def generate_smart_reply(self, original_email: str, fallback: bool = True) -> List[str]:
+        """Generate multiple smart reply options (fallback=False: raise instead of generic options)"""
         if _GEMINI_AVAILABLE and self.client:
             prompt = f"""You are an AI assistant that generates smart reply options for emails. Provide 3 short, professional reply options (1-2 sentences each) that would be appropriate responses to the original email. Return them as a JSON array of strings.\n\nEmail:\n{original_email}\n"""
             try:
-                response = self.client.generate_content(prompt)
-                content = response.text.strip()
+                content = self._generate(prompt, "smart_reply")
                 try:
                     replies = json.loads(content)
                     if isinstance(replies, list):
@@ -125,8 +289,16 @@ class AIService:
                 except json.JSONDecodeError:
                     lines = [line.strip() for line in content.split('\n') if line.strip()]
                     return lines[:3]
+            except RateLimited as e:
+                if not fallback:
+                    raise
+                logger.warning(f"{e}; falling back to generic smart replies.")
             except Exception as e:
+                if not fallback:
+                    raise
                 logger.exception(f"Gemini smart reply failed: {e}; falling back to generic options.")
+        elif not fallback:
+            raise RuntimeError("Gemini is not configured")
         # Fallback: generic smart replies
         return [
             "Thank you for your email. I'll review this and get back to you soon.",
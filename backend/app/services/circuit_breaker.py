@@ -0,0 +1,132 @@
+# backend/app/services/circuit_breaker.py
+import logging
+from typing import Dict, Optional
+
+import redis
+
+from app.config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_FAILURE_WINDOW_SECONDS, CIRCUIT_OPEN_SECONDS
+from app.services.rate_limiter import RateLimited
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger("inboxgenie.circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+PREFIX = "circuit:"
+
+class CircuitOpen(RateLimited):
+    """Raised instead of calling a dependency the breaker considers down.
+
+    Subclasses RateLimited so callers that already back off on throttling (Celery retries,
+    fallback_on_limit) treat an open circuit the same way.
+    """
+    def __init__(self, name: str, retry_after: float):
+        Exception.__init__(self, f"Circuit for {name} is open; retry in {retry_after:.2f}s")
+        self.bucket = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Redis-backed circuit breaker shared by every API and worker process.
+
+    closed:    calls go through; failures within the window are counted.
+    open:      after `failure_threshold` failures calls are refused for `open_seconds`.
+    half_open: once the open period ends a single caller probes the dependency; success
+               closes the circuit, failure opens it again.
+    Like the rate limiter it fails open when Redis is unreachable.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 failure_window: float = CIRCUIT_FAILURE_WINDOW_SECONDS, open_seconds: float = CIRCUIT_OPEN_SECONDS,
+                 redis_client: Optional[redis.Redis] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.open_seconds = open_seconds
+        self._redis = redis_client
+        self.failures_key = f"{PREFIX}{name}:failures"
+        self.open_key = f"{PREFIX}{name}:open"        # present (with a TTL) while open
+        self.tripped_key = f"{PREFIX}{name}:tripped"  # present from opening until a success closes it
+        self.probe_key = f"{PREFIX}{name}:probe"      # held by the single half-open caller
+
+    @property
+    def redis(self) -> redis.Redis:
+        return self._redis if self._redis is not None else get_redis()
+
+    def allow(self, probe_seconds: float) -> bool:
+        """Raise CircuitOpen if the call must not be made. Returns True when the caller is the
+        half-open probe; the probe slot is held for at most `probe_seconds`."""
+        try:
+            open_ms = self.redis.pttl(self.open_key)
+            if open_ms and open_ms > 0:
+                raise CircuitOpen(self.name, open_ms / 1000.0)
+            if not self.redis.exists(self.tripped_key):
+                return False
+            if self.redis.set(self.probe_key, 1, nx=True, px=max(1, int(probe_seconds * 1000))):
+                logger.info(f"Circuit for {self.name} half-open; probing.")
+                return True
+            probe_ms = self.redis.pttl(self.probe_key)
+            raise CircuitOpen(self.name, probe_ms / 1000.0 if probe_ms and probe_ms > 0 else 1.0)
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable ({e}); allowing {self.name} call.")
+            return False
+
+    def record_success(self):
+        try:
+            if self.redis.exists(self.tripped_key):
+                logger.info(f"Circuit for {self.name} closed.")
+            self.redis.delete(self.failures_key, self.tripped_key, self.probe_key)
+        except redis.RedisError:
+            pass
+
+    def release_probe(self):
+        """Give up the half-open probe slot without a verdict, e.g. when the call was never made"""
+        try:
+            self.redis.delete(self.probe_key)
+        except redis.RedisError:
+            pass
+
+    def record_failure(self):
+        """Count a failed call; opens the circuit at the threshold or when the probe fails"""
+        try:
+            if self.redis.exists(self.tripped_key):
+                self._open("probe failed")
+                return
+            failures = self.redis.incr(self.failures_key)
+            if int(failures) == 1:
+                self.redis.expire(self.failures_key, max(1, int(self.failure_window)))
+            if int(failures) >= self.failure_threshold:
+                self._open(f"{failures} failures in {self.failure_window:.0f}s")
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable ({e}); failure of {self.name} not recorded.")
+
+    def _open(self, reason: str):
+        logger.warning(f"Circuit for {self.name} opened for {self.open_seconds:.0f}s ({reason}).")
+        with self.redis.pipeline() as pipe:
+            pipe.set(self.open_key, 1, px=max(1, int(self.open_seconds * 1000)))
+            pipe.set(self.tripped_key, 1)
+            pipe.delete(self.failures_key, self.probe_key)
+            pipe.execute()
+
+    def snapshot(self) -> Dict:
+        """Current state, for health endpoints"""
+        try:
+            open_ms = self.redis.pttl(self.open_key)
+            failures = self.redis.get(self.failures_key)
+            if open_ms and open_ms > 0:
+                state = OPEN
+            elif self.redis.exists(self.tripped_key):
+                state = HALF_OPEN
+            else:
+                state = CLOSED
+            return {
+                "name": self.name,
+                "state": state,
+                "failures": int(failures) if failures else 0,
+                "failure_threshold": self.failure_threshold,
+                "retry_after_seconds": round(open_ms / 1000.0, 2) if state == OPEN else 0.0,
+            }
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable ({e}); no snapshot.")
+            return {"name": self.name, "state": "unknown"}
@@ -0,0 +1,105 @@
+# backend/app/services/counters.py
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.models import Email, EmailLabel, Label, MailboxCounter
+
+UNCLASSIFIED = "UNCLASSIFIED"
+
+# (facets, is_read) of an email at one point in time; None means "not in the mailbox"
+Snapshot = Optional[Tuple[FrozenSet[Tuple[str, str]], bool]]
+
+def _facets(status: Optional[str], category: Optional[str], label_ids: Iterable[str] = ()) -> FrozenSet[Tuple[str, str]]:
+    out = {("status", status or "inbox"), ("category", category or UNCLASSIFIED)}
+    out.update(("label", l) for l in label_ids)
+    return frozenset(out)
+
+def snapshot(email: Email) -> Snapshot:
+    """Capture the counted state of an email; take one before and one after changing it.
+    Labels come from label_links, not the length-capped labels mirror column."""
+    label_ids = [link.label.gmail_label_id for link in email.label_links]
+    return _facets(email.status, email.category, label_ids), bool(email.is_read)
+
+def apply_change(db: Session, user_id: int, before: Snapshot, after: Snapshot):
+    """Adjust the user's counters for one email going from `before` to `after` (same transaction)"""
+    delta = defaultdict(lambda: [0, 0])
+    if before is not None:
+        facets, is_read = before
+        for f in facets:
+            delta[f][0] -= 1
+            delta[f][1] -= 0 if is_read else 1
+    if after is not None:
+        facets, is_read = after
+        for f in facets:
+            delta[f][0] += 1
+            delta[f][1] += 0 if is_read else 1
+    _apply(db, user_id, {f: d for f, d in delta.items() if d[0] or d[1]})
+
+def _apply(db: Session, user_id: int, delta: Dict[Tuple[str, str], list]):
+    if not delta:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        # single atomic upsert, safe with concurrent API requests and workers
+        stmt = pg_insert(MailboxCounter).values([
+            {"user_id": user_id, "kind": kind, "key": key, "total": d[0], "unread": d[1]}
+            for (kind, key), d in delta.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["user_id", "kind", "key"],
+            set_={
+                "total": MailboxCounter.total + stmt.excluded.total,
+                "unread": MailboxCounter.unread + stmt.excluded.unread,
+            },
+        ))
+        return
+    for (kind, key), (d_total, d_unread) in delta.items():
+        row = db.query(MailboxCounter).filter_by(user_id=user_id, kind=kind, key=key).first()
+        if row is None:
+            row = MailboxCounter(user_id=user_id, kind=kind, key=key, total=0, unread=0)
+            db.add(row)
+            # sessions don't autoflush; flush so the next email in this transaction finds the row
+            db.flush()
+        row.total += d_total
+        row.unread += d_unread
+
+def rebuild(db: Session, user_id: int):
+    """Recompute a user's counters from scratch; reconciles any drift and covers bulk changes"""
+    delta = defaultdict(lambda: [0, 0])
+
+    def add(facets, is_read, count):
+        for f in facets:
+            delta[f][0] += count
+            delta[f][1] += 0 if is_read else count
+
+    groups = db.query(
+        Email.status, Email.category, Email.is_read, func.count()
+    ).filter(Email.user_id == user_id).group_by(Email.status, Email.category, Email.is_read)
+    for status, category, is_read, count in groups:
+        add(_facets(status, category), is_read, count)
+    label_groups = db.query(
+        Label.gmail_label_id, Email.is_read, func.count()
+    ).select_from(EmailLabel).join(Label, Label.id == EmailLabel.label_id).join(
+        Email, and_(Email.user_id == EmailLabel.user_id, Email.id == EmailLabel.email_id)
+    ).filter(EmailLabel.user_id == user_id, Email.user_id == user_id).group_by(Label.gmail_label_id, Email.is_read)
+    for gmail_label_id, is_read, count in label_groups:
+        add({("label", gmail_label_id)}, is_read, count)
+
+    db.query(MailboxCounter).filter(MailboxCounter.user_id == user_id).delete(synchronize_session=False)
+    for (kind, key), (total, unread) in delta.items():
+        db.add(MailboxCounter(user_id=user_id, kind=kind, key=key, total=total, unread=unread))
+
+def get_counts(db: Session, user_id: int) -> Dict[str, Dict[str, Dict]]:
+    """Counters grouped by kind, e.g. {"label": {"INBOX": {"name": "INBOX", "total": 10, "unread": 3}}}"""
+    names = dict(db.query(Label.gmail_label_id, Label.name).filter(Label.user_id == user_id))
+    out = {"label": {}, "category": {}, "status": {}}
+    for row in db.query(MailboxCounter).filter(MailboxCounter.user_id == user_id):
+        if row.total or row.unread:
+            entry = {"total": row.total, "unread": row.unread}
+            if row.kind == "label":
+                entry["name"] = names.get(row.key, row.key)
+            out.setdefault(row.kind, {})[row.key] = entry
+    return out
@@ -0,0 +1,95 @@
+# backend/app/services/embeddings.py
+import hashlib
+import logging
+import math
+import re
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+from app.config import EMBEDDING_BACKEND, EMBEDDING_MODEL
+from app.models import Email
+
+logger = logging.getLogger("inboxgenie.embeddings")
+
+try:
+    from sentence_transformers import SentenceTransformer
+    _SENTENCE_TRANSFORMERS_AVAILABLE = True
+except Exception:
+    _SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9']+")
+_STOPWORDS = {
+    "the", "and", "for", "you", "your", "are", "was", "with", "this", "that", "have", "has",
+    "from", "not", "but", "our", "will", "all", "can", "any", "its", "it's", "of", "to", "in",
+    "on", "at", "by", "be", "is", "it", "as", "an", "or", "if", "we", "me", "my", "do", "so",
+}
+
+def email_text(email: Email) -> str:
+    """Text an email is embedded from"""
+    return f"{email.subject or ''}\n{email.snippet or ''}"
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+class HashingEmbedder:
+    """Dependency-free embedder: words and bigrams hashed into signed buckets with sublinear tf.
+
+    Each feature lands in `hashes` buckets, which acts as a sparse random projection of the
+    bag-of-words space. No vocabulary is fitted, so vectors stay comparable as mailboxes grow.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 384, hashes: int = 2):
+        self.dim = dim
+        self.hashes = hashes
+
+    def _features(self, text: str) -> List[str]:
+        tokens = [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in Counter(self._features(text)).items():
+                weight = 1.0 + math.log(count)
+                digest = hashlib.blake2b(feature.encode(), digest_size=4 * self.hashes).digest()
+                for j in range(self.hashes):
+                    h = int.from_bytes(digest[4 * j:4 * j + 4], "big")
+                    out[row, (h >> 1) % self.dim] += weight if h & 1 else -weight
+        return _normalize(out)
+
+class SentenceTransformerEmbedder:
+    """Local CPU sentence-transformers model (loaded once per process)"""
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = f"st-{model_name.replace('/', '_')}"
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+_embedder = None
+
+def get_embedder():
+    """The configured embedder; falls back to hashing when the model backend is unavailable"""
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_BACKEND == "sentence-transformers" and _SENTENCE_TRANSFORMERS_AVAILABLE:
+            try:
+                _embedder = SentenceTransformerEmbedder()
+            except Exception as e:
+                logger.exception(f"Loading embedding model failed: {e}; falling back to hashing embedder.")
+        elif EMBEDDING_BACKEND == "sentence-transformers":
+            logger.warning("sentence-transformers is not installed; falling back to hashing embedder.")
+        if _embedder is None:
+            _embedder = HashingEmbedder()
+    return _embedder
+
+def embedder_key(embedder) -> str:
+    """Identifies the vector space; stored on rows so a backend change triggers re-embedding"""
+    return f"{embedder.name}-{embedder.dim}"
@@ -1,12 +1,20 @@
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google_auth_oauthlib.flow import Flow
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
+import base64
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
 
 from app.config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_REDIRECT_URI
 from app.utils.crypto import encrypt_text, decrypt_text
-from app.models import User, Email
+from app.models import User, Email, ColdEmail
+from app.services import counters
+from app.services.labels import ensure_labels, set_email_labels
+from app.services.near_duplicates import fingerprint_email
+from app.services.rate_limiter import rate_limiter, RateLimited, throttle_status, gmail_bucket
 
 # CORRECTED: Using full, explicit scope URLs to ensure consistency.
 SCOPES = [
@@ -68,25 +76,70 @@ def build_credentials_from_user(user: User) -> Credentials:
     )
     return creds
 
+def build_raw_message(to: str, subject: str, body: str, message_id: Optional[str] = None) -> str:
+    """Build a base64url-encoded MIME message for the Gmail send API"""
+    message = MIMEMultipart()
+    message['to'] = to
+    message['subject'] = subject
+    if message_id:
+        message['Message-ID'] = message_id
+    message.attach(MIMEText(body, 'plain'))
+    return base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+
 class GmailService:
     def __init__(self, user: User):
         creds = build_credentials_from_user(user)
         self.service = build("gmail", "v1", credentials=creds)
+        self.user_id = user.id
+
+    def _execute(self, method: str, request) -> dict:
+        """Execute a Gmail API request against the user's shared quota bucket.
+
+        Raises RateLimited when the bucket is empty or Gmail answers 429/503; callers in
+        Celery should retry with the given countdown rather than sleep.
+        """
+        bucket = gmail_bucket(self.user_id)
+        rate_limiter.acquire_gmail(self.user_id, method)
+        try:
+            result = request.execute()
+        except HttpError as e:
+            if throttle_status(e):
+                delay = rate_limiter.report_throttled(bucket)
+                raise RateLimited(bucket, delay) from e
+            raise
+        rate_limiter.report_success(bucket)
+        return result
 
     def fetch_messages_metadata(self, max_results: int = 20) -> List[dict]:
-        resp = self.service.users().messages().list(userId="me", maxResults=max_results, labelIds=["INBOX"]).execute()
+        request = self.service.users().messages().list(userId="me", maxResults=max_results, labelIds=["INBOX"])
+        resp = self._execute("messages.list", request)
         return resp.get("messages", [])
 
     def get_message(self, msg_id: str, format: str = "full") -> dict:
-        return self.service.users().messages().get(userId="me", id=msg_id, format=format).execute()
+        request = self.service.users().messages().get(userId="me", id=msg_id, format=format)
+        return self._execute("messages.get", request)
 
     def fetch_and_store_inbox(self, db: Session, user: User, max_results: int = 20):
         messages = self.fetch_messages_metadata(max_results=max_results)
         saved = []
+        try:
+            self._store_messages(db, user, messages, saved)
+        except RateLimited:
+            # keep what was fetched so far; the retry skips already stored messages
+            db.commit()
+            raise
+        db.commit()
+        return saved
+
+    def _store_messages(self, db: Session, user: User, messages: List[dict], saved: List[Email]):
+        # one lookup per batch, scoped to the user's partition; mail moved to cold storage stays known
+        ids = [m.get("id") for m in messages]
+        known = {mid for (mid,) in db.query(Email.message_id).filter(Email.user_id == user.id, Email.message_id.in_(ids))}
+        known |= {mid for (mid,) in db.query(ColdEmail.message_id).filter(ColdEmail.user_id == user.id, ColdEmail.message_id.in_(ids))}
+        label_cache = {}
         for m in messages:
             mid = m.get("id")
-            exists = db.query(Email).filter(Email.message_id == mid).first()
-            if exists:
+            if mid in known:
                 continue
             msg = self.get_message(mid, format="full")
             headers = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
@@ -97,6 +150,9 @@ class GmailService:
             # Check if email is read based on Gmail labels
             label_ids = msg.get("labelIds", [])
             is_read = "UNREAD" not in label_ids
+            new_ids = [l for l in label_ids if l not in label_cache]
+            if new_ids:
+                label_cache.update(ensure_labels(db, user.id, new_ids, self.list_labels))
             
             email_row = Email(
                 message_id=mid,
@@ -104,15 +160,26 @@ class GmailService:
                 sender=sender,
                 subject=subject,
                 snippet=snippet,
-                labels="INBOX",
                 is_read=is_read,
                 status="inbox"
             )
+            set_email_labels(email_row, [label_cache[l] for l in label_ids])
+            fingerprint_email(email_row)
             db.add(email_row)
+            counters.apply_change(db, user.id, None, counters.snapshot(email_row))
             saved.append(email_row)
-        db.commit()
-        return saved
+
+    def list_labels(self) -> List[dict]:
+        return self._execute("labels.list", self.service.users().labels().list(userId="me")).get("labels", [])
+
+    def find_sent_message(self, rfc822_message_id: str) -> Optional[dict]:
+        """Look up a message in Sent by its Message-ID header (None if it was never sent)"""
+        request = self.service.users().messages().list(
+            userId="me", q=f"in:sent rfc822msgid:{rfc822_message_id.strip('<>')}", maxResults=1
+        )
+        messages = self._execute("messages.list", request).get("messages", [])
+        return messages[0] if messages else None
 
     def send_raw_message(self, raw_b64: str):
         body = {"raw": raw_b64}
-        return self.service.users().messages().send(userId="me", body=body).execute()
+        return self._execute("messages.send", self.service.users().messages().send(userId="me", body=body))
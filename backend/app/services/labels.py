@@ -0,0 +1,80 @@
+# backend/app/services/labels.py
+from typing import Callable, Dict, Iterable, List
+
+from sqlalchemy.orm import Session
+
+from app.models import Email, EmailLabel, Label
+
+def ensure_labels(db: Session, user_id: int, gmail_label_ids: Iterable[str],
+                  fetch_labels: Callable[[], List[dict]]) -> Dict[str, Label]:
+    """Label rows for the given Gmail label ids, creating missing ones.
+
+    fetch_labels (Gmail labels.list) is only called when an unknown id shows up, so steady-state
+    syncs cost no extra quota.
+    """
+    wanted = set(gmail_label_ids)
+    if not wanted:
+        return {}
+    known = {
+        label.gmail_label_id: label
+        for label in db.query(Label).filter(Label.user_id == user_id, Label.gmail_label_id.in_(wanted))
+    }
+    missing = wanted - known.keys()
+    if missing:
+        info = {l.get("id"): l for l in fetch_labels()}
+        for gmail_id in missing:
+            meta = info.get(gmail_id, {})
+            label = Label(
+                user_id=user_id,
+                gmail_label_id=gmail_id,
+                name=meta.get("name", gmail_id),
+                type=meta.get("type", "user"),
+            )
+            db.add(label)
+            known[gmail_id] = label
+        db.flush()
+    return known
+
+# emails.labels is String(255)
+MIRROR_MAX_LENGTH = 255
+
+def mirror_labels(label_ids: Iterable[str]) -> str:
+    """Comma-separated ids for the legacy labels column; ids that don't fit are left out whole"""
+    out = ""
+    for label_id in label_ids:
+        candidate = f"{out},{label_id}" if out else label_id
+        if len(candidate) <= MIRROR_MAX_LENGTH:
+            out = candidate
+    return out
+
+def set_email_labels(email: Email, labels: List[Label]):
+    """Link an email to its labels and mirror the ids into the legacy comma-separated column.
+    label_links is the source of truth (counters read it); the mirror may omit ids."""
+    email.label_links = [EmailLabel(label=label, user_id=email.user_id) for label in labels]
+    email.labels = mirror_labels(label.gmail_label_id for label in labels)
+
+def remove_label(email: Email, gmail_label_id: str):
+    """Drop one label from an email (e.g. UNREAD when it is marked read)"""
+    email.label_links = [link for link in email.label_links if link.label.gmail_label_id != gmail_label_id]
+    email.labels = mirror_labels(link.label.gmail_label_id for link in email.label_links)
+
+def add_label(db: Session, email: Email, gmail_label_id: str):
+    """Attach one label to an email; used for system labels, so Gmail is never asked for metadata"""
+    if any(link.label.gmail_label_id == gmail_label_id for link in email.label_links):
+        return
+    system = lambda: [{"id": gmail_label_id, "name": gmail_label_id, "type": "system"}]
+    label = ensure_labels(db, email.user_id, [gmail_label_id], system)[gmail_label_id]
+    email.label_links.append(EmailLabel(label=label, user_id=email.user_id))
+    email.labels = mirror_labels(link.label.gmail_label_id for link in email.label_links)
+
+# System labels Gmail shows for each mailbox status
+STATUS_LABELS = {"inbox": {"INBOX"}, "archived": set(), "trashed": {"TRASH"}}
+
+def set_status(db: Session, email: Email, status: str):
+    """Change an email's status and keep its INBOX/TRASH labels in step, as Gmail does"""
+    email.status = status
+    for gmail_label_id in ("INBOX", "TRASH"):
+        if gmail_label_id in STATUS_LABELS.get(status, set()):
+            add_label(db, email, gmail_label_id)
+        else:
+            remove_label(email, gmail_label_id)
@@ -0,0 +1,232 @@
+# backend/app/services/mailbox_io.py
+import io
+import json
+import logging
+from datetime import datetime
+from typing import Dict, IO, Iterable, Iterator, List
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.orm import Session
+
+from app.models import Email
+from app.services import counters
+from app.services.labels import ensure_labels, set_email_labels
+from app.services.near_duplicates import fingerprint_email
+from app.utils.crypto import encrypt_data, decrypt_data
+
+logger = logging.getLogger("inboxgenie.mailbox_io")
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    _PARQUET_AVAILABLE = True
+except Exception:
+    _PARQUET_AVAILABLE = False
+
+CHUNK_SIZE = 1000
+
+# Columns that round-trip between environments; ids, fingerprints and embeddings are rebuilt on import
+PLAIN_COLUMNS = ["message_id", "sender", "subject", "snippet", "labels", "is_spam", "is_read", "status",
+                 "category", "created_at", "updated_at"]
+ENCRYPTED_COLUMNS = {"ai_summary_enc": "ai_summary", "ai_classification_enc": "ai_classification"}
+
+class ExportFormatError(ValueError):
+    pass
+
+def parquet_available() -> bool:
+    return _PARQUET_AVAILABLE
+
+def _decrypt(value):
+    if value is None:
+        return None
+    try:
+        return decrypt_data(value)
+    except Exception:
+        # rows encrypted under an older key stay exportable, just without the AI field
+        return None
+
+def iter_email_chunks(db: Session, user_id: int, decrypt: bool = False,
+                      chunk_size: int = CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """Stream a user's emails in chunks through a server-side cursor (constant memory)"""
+    columns = [getattr(Email, c) for c in PLAIN_COLUMNS + list(ENCRYPTED_COLUMNS)]
+    stmt = select(*columns).where(Email.user_id == user_id).order_by(Email.id)
+    result = db.execute(stmt.execution_options(stream_results=True, yield_per=chunk_size))
+    for partition in result.mappings().partitions(chunk_size):
+        chunk = []
+        for row in partition:
+            record = {c: row[c] for c in PLAIN_COLUMNS}
+            for enc_col, plain_col in ENCRYPTED_COLUMNS.items():
+                if decrypt:
+                    record[plain_col] = _decrypt(row[enc_col])
+                else:
+                    record[enc_col] = row[enc_col]
+            chunk.append(record)
+        yield chunk
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Unserializable value: {value!r}")
+
+def export_ndjson(db: Session, user_id: int, decrypt: bool = False) -> Iterator[bytes]:
+    for chunk in iter_email_chunks(db, user_id, decrypt=decrypt):
+        yield "".join(json.dumps(r, default=_json_default) + "\n" for r in chunk).encode()
+
+def _parquet_schema(decrypt: bool):
+    fields = [
+        ("message_id", pa.string()), ("sender", pa.string()), ("subject", pa.string()),
+        ("snippet", pa.string()), ("labels", pa.string()), ("is_spam", pa.bool_()),
+        ("is_read", pa.bool_()), ("status", pa.string()), ("category", pa.string()),
+        ("created_at", pa.timestamp("us")), ("updated_at", pa.timestamp("us")),
+    ]
+    names = ENCRYPTED_COLUMNS.values() if decrypt else ENCRYPTED_COLUMNS.keys()
+    return pa.schema(fields + [(name, pa.string()) for name in names])
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands finished bytes back to the streaming generator"""
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        out = b"".join(self._parts)
+        self._parts = []
+        return out
+
+def export_parquet(db: Session, user_id: int, decrypt: bool = False) -> Iterator[bytes]:
+    """One row group per chunk; bytes are yielded as soon as each row group is written"""
+    if not _PARQUET_AVAILABLE:
+        raise ExportFormatError("Parquet export requires pyarrow")
+    schema = _parquet_schema(decrypt)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for chunk in iter_email_chunks(db, user_id, decrypt=decrypt):
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+def read_ndjson(fileobj: IO) -> Iterator[Dict]:
+    for line in fileobj:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def read_parquet(path: str, batch_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    if not _PARQUET_AVAILABLE:
+        raise ExportFormatError("Parquet import requires pyarrow")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+def _to_row(record: Dict, user_id: int) -> Dict:
+    row = {c: record.get(c) for c in PLAIN_COLUMNS}
+    for c in ("created_at", "updated_at"):
+        if isinstance(row[c], str):
+            row[c] = datetime.fromisoformat(row[c])
+        row[c] = row[c] or datetime.utcnow()
+    row["is_spam"] = bool(row["is_spam"])
+    row["is_read"] = bool(row["is_read"])
+    row["status"] = row["status"] or "inbox"
+    for enc_col, plain_col in ENCRYPTED_COLUMNS.items():
+        if record.get(plain_col) is not None:
+            row[enc_col] = encrypt_data(record[plain_col])
+        else:
+            row[enc_col] = record.get(enc_col)
+    row["user_id"] = user_id
+    return row
+
+IMPORT_COLUMNS = ["user_id"] + PLAIN_COLUMNS + list(ENCRYPTED_COLUMNS)
+
+def _copy_batch(db: Session, rows: List[Dict]) -> int:
+    """COPY into a temp staging table, then insert while skipping messages that already exist"""
+    buf = io.StringIO()
+    buf.writelines(",".join(_csv_value(r[c]) for c in IMPORT_COLUMNS) + "\n" for r in rows)
+    buf.seek(0)
+    cols = ", ".join(IMPORT_COLUMNS)
+    db.execute(text(
+        "CREATE TEMP TABLE IF NOT EXISTS emails_import "
+        "(LIKE emails INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    ))
+    raw = db.connection().connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert(f"COPY emails_import ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+    result = db.execute(text(
+        f"INSERT INTO emails ({cols}) SELECT {cols} FROM emails_import "
+        f"ON CONFLICT (user_id, message_id) DO NOTHING"
+    ))
+    return result.rowcount
+
+def _csv_value(value) -> str:
+    # Only an unquoted \N is NULL; every value is quoted, so "" and a literal "\N" stay strings
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+def _insert_batch(db: Session, rows: List[Dict]) -> int:
+    ids = [r["message_id"] for r in rows]
+    user_id = rows[0]["user_id"]
+    known = {mid for (mid,) in db.query(Email.message_id).filter(Email.user_id == user_id, Email.message_id.in_(ids))}
+    fresh = list({r["message_id"]: r for r in rows if r["message_id"] not in known}.values())
+    if fresh:
+        db.execute(insert(Email), fresh)
+    return len(fresh)
+
+def import_records(db: Session, user_id: int, records: Iterable[Dict], batch_size: int = CHUNK_SIZE) -> int:
+    """Bulk-load exported records for a user; COPY on Postgres, batched inserts elsewhere.
+    Messages the user already has are skipped. Returns the number of rows inserted."""
+    load = _copy_batch if db.get_bind().dialect.name == "postgresql" else _insert_batch
+    inserted = 0
+    batch = []
+    for record in records:
+        if not record.get("message_id"):
+            continue
+        batch.append(_to_row(record, user_id))
+        if len(batch) >= batch_size:
+            inserted += load(db, batch)
+            db.commit()
+            batch = []
+    if batch:
+        inserted += load(db, batch)
+        db.commit()
+    if inserted:
+        index_emails(db, user_id)
+        counters.rebuild(db, user_id)
+        db.commit()
+    return inserted
+
+def index_emails(db: Session, user_id: int, chunk_size: int = CHUNK_SIZE):
+    """Rebuild what imported or migrated rows don't carry: LSH bands and email_labels links (from the
+    labels mirror). Labels first seen here are named after their id until a sync has Gmail's metadata."""
+    last_id = 0
+    while True:
+        rows = db.query(Email).filter(
+            Email.user_id == user_id,
+            Email.id > last_id,
+            Email.simhash.is_(None),
+            ~Email.label_links.any(),
+        ).order_by(Email.id).limit(chunk_size).all()
+        if not rows:
+            return
+        label_ids = {l for e in rows for l in (e.labels or "").split(",") if l}
+        known = ensure_labels(db, user_id, label_ids, lambda: [])
+        for email in rows:
+            fingerprint_email(email)
+            set_email_labels(email, [known[l] for l in dict.fromkeys((email.labels or "").split(",")) if l])
+            email.updated_at = Email.updated_at  # indexing isn't a change to the mail; keep retention's clock
+        db.commit()
+        last_id = rows[-1].id
+
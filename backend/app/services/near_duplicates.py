@@ -0,0 +1,91 @@
+# backend/app/services/near_duplicates.py
+import ast
+import logging
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.config import NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_LSH_BANDS
+from app.models import Email, EmailLshBand
+from app.utils.crypto import decrypt_data
+from app.utils.simhash import simhash, hamming_distance, band_values, to_signed, to_unsigned
+
+logger = logging.getLogger("inboxgenie.dedup")
+
+# Fingerprints within distance < BANDS always share a band (pigeonhole); wider bands keep lookups selective.
+# Changing the band count only affects rows fingerprinted afterwards.
+BANDS = NEAR_DUPLICATE_LSH_BANDS
+# Candidates compared per lookup; the newest classified rows are the most likely templates
+MAX_CANDIDATES = 500
+
+def fingerprint_text(email: Email) -> str:
+    return f"{email.subject or ''}\n{email.snippet or ''}"
+
+def fingerprint_email(email: Email):
+    """Compute the SimHash and LSH bands for an email (persisted with the row)"""
+    value = simhash(fingerprint_text(email))
+    if value is None:
+        # nothing to compare on (empty or image-only mail): never matched, never reused
+        email.simhash = None
+        email.lsh_bands = []
+        return
+    email.simhash = to_signed(value)
+    email.lsh_bands = [
+        EmailLshBand(band=i, value=v, user_id=email.user_id)
+        for i, v in enumerate(band_values(value, BANDS))
+    ]
+
+def find_near_duplicate(db: Session, email: Email) -> Optional[Tuple[Email, int]]:
+    """Closest email of the same user that the model classified, within the configured distance"""
+    if email.simhash is None:
+        return None
+    value = to_unsigned(email.simhash)
+    same_band = or_(*[
+        and_(EmailLshBand.band == i, EmailLshBand.value == v)
+        for i, v in enumerate(band_values(value, BANDS))
+    ])
+    # filtering both tables on user_id keeps the lookup inside one partition of each
+    candidates = db.query(Email.id, Email.simhash).join(
+        EmailLshBand, and_(EmailLshBand.email_id == Email.id, EmailLshBand.user_id == Email.user_id)
+    ).filter(
+        Email.user_id == email.user_id,
+        EmailLshBand.user_id == email.user_id,
+        same_band,
+        Email.id != email.id,
+        Email.simhash != 0,  # blank mails fingerprinted before blanks got no fingerprint
+        Email.ai_classification_enc.isnot(None),
+        Email.classification_source == "model",  # a heuristic fallback must not spread to a template family
+    ).distinct().order_by(Email.id.desc()).limit(MAX_CANDIDATES).all()
+
+    best_id, best_distance = None, NEAR_DUPLICATE_MAX_DISTANCE + 1
+    for cid, chash in candidates:
+        distance = hamming_distance(value, to_unsigned(chash))
+        if distance < best_distance:
+            best_id, best_distance = cid, distance
+            if distance == 0:
+                break
+    if best_id is None:
+        return None
+    return db.query(Email).filter(Email.user_id == email.user_id, Email.id == best_id).first(), best_distance
+
+def reuse_classification(db: Session, email: Email) -> Optional[Dict]:
+    """Classification of a near-duplicate email, or None if the model has to be called"""
+    if email.simhash is None or email.simhash == 0:
+        # 0 may be a blank mail fingerprinted before blanks got no fingerprint; recompute to tell
+        fingerprint_email(email)
+        db.flush()
+    match = find_near_duplicate(db, email)
+    if match is None:
+        return None
+    duplicate, distance = match
+    try:
+        result = ast.literal_eval(decrypt_data(duplicate.ai_classification_enc))
+    except Exception as e:
+        logger.warning(f"Unreadable classification on email {duplicate.id}: {e}")
+        return None
+    if not isinstance(result, dict) or "label" not in result:
+        return None
+    result["reused_from"] = duplicate.id
+    result["distance"] = distance
+    return result
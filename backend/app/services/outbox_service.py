@@ -0,0 +1,176 @@
+# backend/app/services/outbox_service.py
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import redis
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import User, Email, OutboxMessage
+from app.services import counters
+from app.services.gmail_service import GmailService, build_raw_message
+from app.services.labels import add_label
+from app.services.near_duplicates import fingerprint_email
+from app.utils.crypto import encrypt_text, decrypt_text
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger("inboxgenie.outbox")
+
+# A row stuck in "sending" this long belonged to a worker that died mid-send
+STALE_SENDING_SECONDS = 600
+# Pending rows this far past their due time were never picked up (e.g. the enqueue to the broker failed)
+STALE_PENDING_SECONDS = 60
+# Give up after this many delivery attempts, however many task chains made them
+MAX_ATTEMPTS = 10
+
+def status_channel(user_id: int) -> str:
+    """Redis pub/sub channel carrying delivery status updates for one user"""
+    return f"outbox:user:{user_id}"
+
+def serialize(row: OutboxMessage) -> dict:
+    return {
+        "outbox_id": row.id,
+        "idempotency_key": row.idempotency_key,
+        "status": row.status,
+        "attempts": row.attempts,
+        "to": row.to_addr,
+        "subject": row.subject,
+        "message_id": row.gmail_message_id,
+        "last_error": row.last_error,
+        "sent_at": row.sent_at.isoformat() if row.sent_at else None,
+    }
+
+def publish_status(row: OutboxMessage):
+    try:
+        get_redis().publish(status_channel(row.user_id), json.dumps(serialize(row)))
+    except redis.RedisError as e:
+        logger.warning(f"Could not publish outbox status for {row.id}: {e}")
+
+def enqueue_message(db: Session, user: User, to: str, subject: str, body: str,
+                    idempotency_key: Optional[str] = None) -> Tuple[OutboxMessage, bool]:
+    """Persist an outgoing message. Returns (row, created); a repeated idempotency key returns the original row."""
+    key = idempotency_key or uuid.uuid4().hex
+    row = OutboxMessage(
+        user_id=user.id,
+        idempotency_key=key,
+        rfc822_message_id=f"<{uuid.uuid4().hex}@inboxgenie>",
+        to_addr=to,
+        subject=subject,
+        body_enc=encrypt_text(body),
+        status="pending",
+        attempts=0,
+    )
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = db.query(OutboxMessage).filter(
+            OutboxMessage.user_id == user.id, OutboxMessage.idempotency_key == key
+        ).first()
+        if existing is None:
+            raise
+        return existing, False
+    db.refresh(row)
+    return row, True
+
+def claim(db: Session, outbox_id: int) -> Optional[OutboxMessage]:
+    """Atomically move a row to "sending" so only one worker delivers it"""
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=STALE_SENDING_SECONDS)
+    claimed = db.query(OutboxMessage).filter(
+        OutboxMessage.id == outbox_id,
+        or_(
+            OutboxMessage.status == "pending",
+            and_(OutboxMessage.status == "sending", OutboxMessage.updated_at < stale),
+        ),
+    ).update(
+        {"status": "sending", "attempts": OutboxMessage.attempts + 1, "updated_at": now},
+        synchronize_session=False,
+    )
+    db.commit()
+    if not claimed:
+        return None
+    row = db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id).first()
+    publish_status(row)
+    return row
+
+def deliver(db: Session, row: OutboxMessage) -> OutboxMessage:
+    """Send a claimed row through Gmail and record it as sent"""
+    gmail_service = GmailService(row.owner)
+    # An earlier attempt may have reached Gmail before its commit failed; never send twice
+    existing = gmail_service.find_sent_message(row.rfc822_message_id) if row.attempts > 1 else None
+    if existing:
+        gmail_id = existing.get("id", "")
+    else:
+        raw = build_raw_message(row.to_addr, row.subject, decrypt_text(row.body_enc), row.rfc822_message_id)
+        gmail_id = gmail_service.send_raw_message(raw).get("id", "")
+
+    row.status = "sent"
+    row.gmail_message_id = gmail_id
+    row.sent_at = datetime.utcnow()
+    row.last_error = None
+
+    # Store sent email in database for reference
+    if not db.query(Email).filter(Email.user_id == row.user_id, Email.message_id == gmail_id).first():
+        sent_email = Email(
+            message_id=gmail_id,
+            user_id=row.user_id,
+            sender=row.owner.email,
+            subject=f"Sent: {row.subject}",
+            snippet=f"To: {row.to_addr}",
+            status="sent",
+            is_read=True
+        )
+        add_label(db, sent_email, "SENT")
+        fingerprint_email(sent_email)
+        db.add(sent_email)
+        counters.apply_change(db, row.user_id, None, counters.snapshot(sent_email))
+    db.commit()
+    publish_status(row)
+    return row
+
+def release(db: Session, outbox_id: int, error: str, final: bool = False,
+            retry_in: float = 0.0) -> Optional[OutboxMessage]:
+    """Record a failed attempt: back to "pending" with a retry due in `retry_in` seconds, or "failed" when giving up"""
+    row = db.query(OutboxMessage).filter(OutboxMessage.id == outbox_id).first()
+    if row is None or row.status == "sent":
+        return row
+    row.status = "failed" if final else "pending"
+    row.next_attempt_at = None if final else datetime.utcnow() + timedelta(seconds=retry_in)
+    row.last_error = error[:2000]
+    db.commit()
+    publish_status(row)
+    return row
+
+def should_give_up(row: OutboxMessage, exc: Exception) -> bool:
+    """Permanent Gmail errors fail at once; anything else after MAX_ATTEMPTS claims of the row"""
+    return is_permanent_error(exc) or (row.attempts or 0) >= MAX_ATTEMPTS
+
+def is_permanent_error(exc: Exception) -> bool:
+    """Gmail 4xx responses (bad recipient, revoked grant...) won't succeed on retry"""
+    resp = getattr(exc, "resp", None)
+    status = getattr(resp, "status", None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return 400 <= status < 500 and status != 429
+
+def find_undispatched(db: Session, limit: int = 100):
+    """Rows that should be in flight but aren't: never enqueued, a scheduled retry that never
+    ran, or abandoned mid-send. Rows whose retry is still due later are left to their task."""
+    now = datetime.utcnow()
+    due = func.coalesce(OutboxMessage.next_attempt_at, OutboxMessage.updated_at)
+    return db.query(OutboxMessage.id).filter(
+        or_(
+            and_(OutboxMessage.status == "pending",
+                 due < now - timedelta(seconds=STALE_PENDING_SECONDS)),
+            and_(OutboxMessage.status == "sending",
+                 OutboxMessage.updated_at < now - timedelta(seconds=STALE_SENDING_SECONDS)),
+        )
+    ).order_by(OutboxMessage.id).limit(limit).all()
@@ -0,0 +1,201 @@
+# backend/app/services/rate_limiter.py
+import logging
+import random
+from typing import Dict, List, Optional
+
+import redis
+
+from app.config import (
+    GMAIL_USER_QUOTA_PER_SECOND,
+    GEMINI_REQUESTS_PER_MINUTE,
+    RATE_LIMIT_BACKOFF_BASE,
+    RATE_LIMIT_BACKOFF_MAX,
+)
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger("inboxgenie.ratelimit")
+
+# Gmail API quota units charged per method (see Gmail API "Usage limits")
+GMAIL_QUOTA_COSTS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.send": 100,
+    "messages.modify": 5,
+    "messages.trash": 5,
+    "messages.untrash": 5,
+    "messages.batchModify": 50,
+    "history.list": 2,
+    "labels.list": 1,
+    "labels.get": 1,
+    "getProfile": 1,
+}
+DEFAULT_GMAIL_COST = 5
+
+# HTTP statuses that mean "slow down" rather than "this request is broken"
+RETRYABLE_STATUSES = {429, 503}
+
+BUCKET_PREFIX = "ratelimit:bucket:"
+COOLDOWN_PREFIX = "ratelimit:cooldown:"
+STRIKES_PREFIX = "ratelimit:strikes:"
+STRIKES_TTL_SECONDS = 600
+
+GEMINI_BUCKET = "gemini"
+
+def gmail_bucket(user_id: int) -> str:
+    return f"gmail:user:{user_id}"
+
+class RateLimited(Exception):
+    """Raised when a bucket has no tokens left; retry_after is in seconds"""
+    def __init__(self, bucket: str, retry_after: float):
+        super().__init__(f"Rate limit reached for {bucket}; retry in {retry_after:.2f}s")
+        self.bucket = bucket
+        self.retry_after = retry_after
+
+def throttle_status(exc: Exception) -> Optional[int]:
+    """Return 429/503 if the exception is an upstream throttling error, otherwise None.
+
+    Handles googleapiclient's HttpError (exc.resp.status) and google.api_core errors (exc.code).
+    """
+    resp = getattr(exc, "resp", None)
+    status = getattr(resp, "status", None) if resp is not None else getattr(exc, "code", None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return None
+    return status if status in RETRYABLE_STATUSES else None
+
+def backoff_delay(attempt: int, base: float = RATE_LIMIT_BACKOFF_BASE, cap: float = RATE_LIMIT_BACKOFF_MAX) -> float:
+    """Exponential backoff with jitter: half the window is fixed, the other half random"""
+    window = min(cap, base * (2 ** max(attempt, 0)))
+    return window / 2 + random.uniform(0, window / 2)
+
+class RateLimiter:
+    """Redis-backed token buckets shared by every API and worker process.
+
+    Each bucket is a hash holding the remaining tokens and the last refill time. Updates use
+    WATCH/MULTI so they stay atomic across processes.
+    When Redis is unreachable the limiter fails open so requests are never blocked on it.
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis] = None):
+        self._redis = redis_client
+
+    @property
+    def redis(self) -> redis.Redis:
+        return self._redis if self._redis is not None else get_redis()
+
+    def try_acquire(self, bucket: str, cost: float, capacity: float, refill_per_second: float) -> float:
+        """Take `cost` tokens from the bucket. Returns 0 on success, otherwise seconds to wait."""
+        if cost > capacity:
+            raise ValueError(f"cost {cost} exceeds bucket capacity {capacity} for {bucket}")
+        key = BUCKET_PREFIX + bucket
+        cooldown_key = COOLDOWN_PREFIX + bucket
+        try:
+            with self.redis.pipeline() as pipe:
+                while True:
+                    try:
+                        pipe.watch(key)
+                        cooldown_ms = pipe.pttl(cooldown_key)
+                        if cooldown_ms and cooldown_ms > 0:
+                            pipe.unwatch()
+                            return cooldown_ms / 1000.0
+                        seconds, micros = pipe.time()
+                        now = float(seconds) + float(micros) / 1_000_000
+                        tokens, last = pipe.hmget(key, "tokens", "ts")
+                        tokens = capacity if tokens is None else float(tokens)
+                        last = now if last is None else float(last)
+                        tokens = min(capacity, tokens + max(0.0, now - last) * refill_per_second)
+                        wait = 0.0
+                        if tokens >= cost:
+                            tokens -= cost
+                        else:
+                            wait = (cost - tokens) / refill_per_second
+                        pipe.multi()
+                        pipe.hset(key, mapping={
+                            "tokens": tokens,
+                            "ts": now,
+                            "capacity": capacity,
+                            "rate": refill_per_second,
+                        })
+                        # Idle buckets are full again after capacity / rate seconds; let them expire
+                        pipe.expire(key, int(capacity / refill_per_second) + 60)
+                        pipe.execute()
+                        return wait
+                    except redis.WatchError:
+                        continue
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable ({e}); allowing {bucket} request.")
+            return 0.0
+
+    def acquire(self, bucket: str, cost: float, capacity: float, refill_per_second: float):
+        wait = self.try_acquire(bucket, cost, capacity, refill_per_second)
+        if wait > 0:
+            raise RateLimited(bucket, wait)
+
+    def acquire_gmail(self, user_id: int, method: str):
+        """Charge the Gmail per-user quota for one API call"""
+        cost = GMAIL_QUOTA_COSTS.get(method, DEFAULT_GMAIL_COST)
+        self.acquire(gmail_bucket(user_id), cost, GMAIL_USER_QUOTA_PER_SECOND, GMAIL_USER_QUOTA_PER_SECOND)
+
+    def acquire_gemini(self):
+        """Charge one request against the Gemini requests-per-minute limit"""
+        self.acquire(GEMINI_BUCKET, 1, GEMINI_REQUESTS_PER_MINUTE, GEMINI_REQUESTS_PER_MINUTE / 60.0)
+
+    def report_throttled(self, bucket: str) -> float:
+        """Record an upstream 429/503 and pause the bucket for every process. Returns the delay."""
+        try:
+            strikes = self.redis.incr(STRIKES_PREFIX + bucket)
+            self.redis.expire(STRIKES_PREFIX + bucket, STRIKES_TTL_SECONDS)
+            delay = backoff_delay(int(strikes) - 1)
+            cooldown_key = COOLDOWN_PREFIX + bucket
+            remaining_ms = self.redis.pttl(cooldown_key)
+            if not remaining_ms or remaining_ms < delay * 1000:
+                self.redis.set(cooldown_key, int(strikes), px=max(1, int(delay * 1000)))
+            return delay
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable ({e}); using local backoff for {bucket}.")
+            return backoff_delay(0)
+
+    def report_success(self, bucket: str):
+        """Reset the backoff once upstream accepts requests again"""
+        try:
+            self.redis.delete(STRIKES_PREFIX + bucket)
+        except redis.RedisError:
+            pass
+
+    def cooldown_seconds(self, bucket: str) -> float:
+        """Seconds left on the bucket's upstream backoff, 0.0 when none is active"""
+        try:
+            cooldown_ms = self.redis.pttl(COOLDOWN_PREFIX + bucket)
+        except redis.RedisError:
+            return 0.0
+        return round(cooldown_ms / 1000.0, 2) if cooldown_ms and cooldown_ms > 0 else 0.0
+
+    def snapshot(self) -> List[Dict]:
+        """Current state of every known bucket, for health/ops endpoints"""
+        states = []
+        try:
+            for key in self.redis.scan_iter(match=BUCKET_PREFIX + "*"):
+                key = key.decode() if isinstance(key, bytes) else key
+                bucket = key[len(BUCKET_PREFIX):]
+                data = self.redis.hgetall(key)
+                data = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in data.items()}
+                seconds, micros = self.redis.time()
+                now = float(seconds) + float(micros) / 1_000_000
+                capacity = data.get("capacity", 0.0)
+                tokens = min(capacity, data.get("tokens", 0.0) + max(0.0, now - data.get("ts", now)) * data.get("rate", 0.0))
+                cooldown_ms = self.redis.pttl(COOLDOWN_PREFIX + bucket)
+                strikes = self.redis.get(STRIKES_PREFIX + bucket)
+                states.append({
+                    "bucket": bucket,
+                    "tokens": round(tokens, 2),
+                    "capacity": capacity,
+                    "refill_per_second": data.get("rate", 0.0),
+                    "cooldown_seconds": round(cooldown_ms / 1000.0, 2) if cooldown_ms and cooldown_ms > 0 else 0.0,
+                    "strikes": int(strikes) if strikes else 0,
+                })
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable ({e}); no snapshot.")
+        return sorted(states, key=lambda s: s["bucket"])
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,60 @@
+# backend/app/services/reply_precompute.py
+import json
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import redis
+
+from app.config import SMART_REPLY_DAILY_CAP
+from app.models import Email
+from app.utils.crypto import encrypt_data, decrypt_data
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger("inboxgenie.replies")
+
+def reply_source_text(email: Email) -> str:
+    """Same shape the compose UI sends to /ai/smart-reply and /ai/auto-reply"""
+    return f"Subject: {email.subject or ''}\nFrom: {email.sender or ''}\nContent: {email.snippet or ''}"
+
+def _cap_key(user_id: int) -> str:
+    return f"replies:precomputed:{user_id}:{datetime.utcnow():%Y%m%d}"
+
+def has_slot(user_id: int) -> bool:
+    """Whether the user's daily cap has room left, without using it up"""
+    try:
+        used = get_redis().get(_cap_key(user_id))
+        return int(used or 0) < SMART_REPLY_DAILY_CAP
+    except redis.RedisError as e:
+        logger.warning(f"Could not check reply cap for user {user_id}: {e}")
+        return False
+
+def reserve_slot(user_id: int) -> bool:
+    """Count one stored precomputation against the user's daily cap; False once the cap is reached"""
+    key = _cap_key(user_id)
+    try:
+        client = get_redis()
+        used = client.incr(key)
+        if used == 1:
+            client.expire(key, 2 * 24 * 3600)
+        return used <= SMART_REPLY_DAILY_CAP
+    except redis.RedisError as e:
+        logger.warning(f"Could not check reply cap for user {user_id}: {e}")
+        return False
+
+def store_replies(email: Email, smart_replies: List[str], auto_reply: str):
+    email.ai_replies_enc = encrypt_data(json.dumps({
+        "smart_replies": smart_replies,
+        "auto_reply": auto_reply,
+        "generated_at": datetime.utcnow().isoformat(),
+    }))
+
+def load_replies(email: Optional[Email]) -> Optional[Dict]:
+    """Precomputed replies for an email, or None if they have to be generated live"""
+    if email is None or not email.ai_replies_enc:
+        return None
+    try:
+        return json.loads(decrypt_data(email.ai_replies_enc))
+    except Exception as e:
+        logger.warning(f"Unreadable precomputed replies on email {email.id}: {e}")
+        return None
@@ -0,0 +1,110 @@
+# backend/app/services/retention.py
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.config import (
+    TRASH_RETENTION_DAYS,
+    ARCHIVE_RETENTION_DAYS,
+    COLD_RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+)
+from app.models import User, Email, ColdEmail
+from app.services import counters
+
+logger = logging.getLogger("inboxgenie.retention")
+
+def compress_snippet(snippet: Optional[str]) -> Optional[bytes]:
+    return zlib.compress(snippet.encode(), 9) if snippet else None
+
+def cold_snippet(row: ColdEmail) -> str:
+    return zlib.decompress(row.snippet_z).decode() if row.snippet_z else ""
+
+def move_to_cold(db: Session, user_id: int, status: str, older_than_days: int,
+                 batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Move one user's mail in `status` untouched for `older_than_days` into emails_cold.
+
+    Works in batches, each in its own transaction, and always filters on user_id so Postgres
+    only scans that user's partition.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        rows = db.query(
+            Email.id, Email.message_id, Email.sender, Email.subject, Email.snippet, Email.labels,
+            Email.ai_classification_enc, Email.is_spam, Email.is_read, Email.status, Email.created_at,
+        ).filter(
+            Email.user_id == user_id,
+            Email.status == status,
+            Email.updated_at < cutoff,
+        ).order_by(Email.id).limit(batch_size).all()
+        if not rows:
+            return moved
+
+        now = datetime.utcnow()
+        db.execute(insert(ColdEmail), [{
+            "id": r.id,
+            "user_id": user_id,
+            "message_id": r.message_id,
+            "sender": r.sender,
+            "subject": r.subject,
+            "snippet_z": compress_snippet(r.snippet),
+            "labels": r.labels,
+            "ai_classification_enc": r.ai_classification_enc,
+            "is_spam": r.is_spam,
+            "is_read": r.is_read,
+            "status": r.status,
+            "created_at": r.created_at,
+            "moved_at": now,
+        } for r in rows])
+        # LSH bands go with the row through ON DELETE CASCADE
+        db.query(Email).filter(
+            Email.user_id == user_id, Email.id.in_([r.id for r in rows])
+        ).delete(synchronize_session=False)
+        db.commit()
+        moved += len(rows)
+        if len(rows) < batch_size:
+            return moved
+
+def purge_cold(db: Session, user_id: int, older_than_days: int, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Delete one user's cold mail that has been in cold storage for `older_than_days`"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    purged = 0
+    while True:
+        ids = [i for (i,) in db.query(ColdEmail.id).filter(
+            ColdEmail.user_id == user_id, ColdEmail.moved_at < cutoff
+        ).limit(batch_size).all()]
+        if not ids:
+            return purged
+        db.query(ColdEmail).filter(ColdEmail.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        purged += len(ids)
+
+def run_retention(db: Session) -> Dict:
+    """Apply every retention tier to every user"""
+    totals = {"trashed_moved": 0, "archived_moved": 0, "cold_purged": 0}
+    for (user_id,) in db.query(User.id).all():
+        try:
+            moved = 0
+            if TRASH_RETENTION_DAYS > 0:
+                trashed = move_to_cold(db, user_id, "trashed", TRASH_RETENTION_DAYS)
+                totals["trashed_moved"] += trashed
+                moved += trashed
+            if ARCHIVE_RETENTION_DAYS > 0:
+                archived = move_to_cold(db, user_id, "archived", ARCHIVE_RETENTION_DAYS)
+                totals["archived_moved"] += archived
+                moved += archived
+            if moved:
+                # counters only cover hot mail; recount once instead of per moved row
+                counters.rebuild(db, user_id)
+                db.commit()
+            if COLD_RETENTION_DAYS > 0:
+                totals["cold_purged"] += purge_cold(db, user_id, COLD_RETENTION_DAYS)
+        except Exception as e:
+            db.rollback()
+            logger.exception(f"Retention failed for user {user_id}: {e}")
+    return totals
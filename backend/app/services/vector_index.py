@@ -0,0 +1,114 @@
+# backend/app/services/vector_index.py
+import fcntl
+import os
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import EMBEDDING_DIR, VECTOR_ANN_THRESHOLD
+from app.services.embeddings import embedder_key
+
+CODE_BITS = 64
+_CODE_BYTES = CODE_BITS // 8
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+class VectorIndex:
+    """Per-user, append-only vector store backed by flat files and read through np.memmap.
+
+    Three files grow in lockstep: float32 vectors (n x dim), int64 email ids and packed
+    sign-random-projection codes used to prefilter candidates once the index is large.
+    Readers use the shortest of the three, so a half-finished append is never visible.
+    """
+
+    def __init__(self, user_id: int, embedder, root: str = EMBEDDING_DIR):
+        self.dim = embedder.dim
+        self.dir = os.path.join(root, str(user_id))
+        base = os.path.join(self.dir, embedder_key(embedder))
+        self.vectors_path = base + ".f32"
+        self.ids_path = base + ".ids"
+        self.codes_path = base + ".codes"
+        self.lock_path = base + ".lock"
+        # Hyperplanes are seeded so every process computes the same codes
+        self.planes = np.random.default_rng(CODE_BITS).standard_normal((self.dim, CODE_BITS)).astype(np.float32)
+
+    def _codes(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors @ self.planes > 0, axis=1)
+
+    def add(self, email_ids: List[int], vectors: np.ndarray):
+        """Append vectors (already L2-normalized) for the given email ids"""
+        if not email_ids:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.vectors_path, "ab") as f:
+                    f.write(vectors.tobytes())
+                with open(self.codes_path, "ab") as f:
+                    f.write(self._codes(vectors).tobytes())
+                # ids last: a row only becomes visible once all three parts are written
+                with open(self.ids_path, "ab") as f:
+                    f.write(np.asarray(email_ids, dtype=np.int64).tobytes())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _open(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        sizes = [
+            os.path.getsize(p) if os.path.exists(p) else 0
+            for p in (self.vectors_path, self.ids_path, self.codes_path)
+        ]
+        n = min(sizes[0] // (4 * self.dim), sizes[1] // 8, sizes[2] // _CODE_BYTES)
+        if n == 0:
+            empty = np.empty((0, self.dim), dtype=np.float32)
+            return empty, np.empty(0, dtype=np.int64), np.empty((0, _CODE_BYTES), dtype=np.uint8)
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        ids = np.memmap(self.ids_path, dtype=np.int64, mode="r", shape=(n,))
+        codes = np.memmap(self.codes_path, dtype=np.uint8, mode="r", shape=(n, _CODE_BYTES))
+        return vectors, ids, codes
+
+    def __len__(self) -> int:
+        return len(self._open()[1])
+
+    def vector_for(self, email_id: int) -> Optional[np.ndarray]:
+        vectors, ids, _ = self._open()
+        rows = np.flatnonzero(ids == email_id)
+        if len(rows) == 0:
+            return None
+        return np.array(vectors[rows[-1]])
+
+    def search(self, query: np.ndarray, k: int = 10, exclude: Iterable[int] = ()) -> List[Tuple[int, float]]:
+        """Top-k (email_id, cosine similarity), best first"""
+        vectors, ids, codes = self._open()
+        n = len(ids)
+        if n == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        exclude = set(exclude)
+        # re-embedded emails appear more than once; over-fetch so dedupe still leaves k
+        want = min(n, k + len(exclude) + 16)
+
+        if n > VECTOR_ANN_THRESHOLD:
+            # Approximate: rank by Hamming distance of binary codes, rerank the shortlist exactly
+            qcode = self._codes(query[None, :])[0]
+            distances = _POPCOUNT[np.bitwise_xor(codes, qcode)].sum(axis=1, dtype=np.int32)
+            shortlist = min(n, max(want * 50, 2000))
+            rows = np.sort(np.argpartition(distances, shortlist - 1)[:shortlist])
+            scores = np.asarray(vectors[rows]) @ query
+        else:
+            rows = np.arange(n)
+            scores = np.asarray(vectors) @ query
+
+        top = np.argpartition(-scores, want - 1)[:want] if want < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+
+        results, seen = [], set()
+        for i in top:
+            email_id = int(ids[rows[i]])
+            if email_id in exclude or email_id in seen:
+                continue
+            seen.add(email_id)
+            results.append((email_id, float(scores[i])))
+            if len(results) == k:
+                break
+        return results
@@ -0,0 +1,30 @@
+# backend/app/utils/metrics.py
+import logging
+from typing import Dict
+
+import redis
+
+from app.utils.redis_client import get_redis
+
+logger = logging.getLogger("inboxgenie.metrics")
+
+PREFIX = "metrics:"
+
+def incr(name: str, amount: int = 1):
+    """Bump a shared counter; metrics never break the caller"""
+    try:
+        get_redis().incrby(PREFIX + name, amount)
+    except redis.RedisError as e:
+        logger.debug(f"Could not record metric {name}: {e}")
+
+def counters() -> Dict[str, int]:
+    """All counters, keyed by name"""
+    out = {}
+    try:
+        client = get_redis()
+        for key in client.scan_iter(match=PREFIX + "*"):
+            value = client.get(key)
+            out[key[len(PREFIX):]] = int(value) if value else 0
+    except redis.RedisError as e:
+        logger.warning(f"Could not read metrics: {e}")
+    return dict(sorted(out.items()))
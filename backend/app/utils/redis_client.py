@@ -0,0 +1,12 @@
+# backend/app/utils/redis_client.py
+import redis
+from app.config import REDIS_URL
+
+_client = None
+
+def get_redis() -> redis.Redis:
+    """Return a process-wide Redis client (connections are pooled and created lazily)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+    return _client
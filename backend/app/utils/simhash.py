@@ -0,0 +1,54 @@
+# backend/app/utils/simhash.py
+import hashlib
+import re
+from typing import List, Optional
+
+BITS = 64
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_DIGITS_RE = re.compile(r"\d+")
+
+def _features(text: str) -> List[str]:
+    # Numbers are what usually differ between templated mails (amounts, order ids, dates)
+    tokens = _TOKEN_RE.findall(_DIGITS_RE.sub("0", (text or "").lower()))
+    # Unigrams keep short snippets stable, bigrams keep word order meaningful
+    return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+def _hash64(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+def simhash(text: str) -> Optional[int]:
+    """64-bit SimHash over words and word bigrams; similar texts get fingerprints with a small Hamming distance.
+    None for text without any words: blank mails would otherwise all share the fingerprint 0."""
+    features = _features(text)
+    if not features:
+        return None
+    weights = [0] * BITS
+    for feature in features:
+        h = _hash64(feature)
+        for i in range(BITS):
+            weights[i] += 1 if (h >> i) & 1 else -1
+    value = 0
+    for i, w in enumerate(weights):
+        if w > 0:
+            value |= 1 << i
+    return value
+
+def hamming_distance(a: int, b: int) -> int:
+    return ((a ^ b) & ((1 << BITS) - 1)).bit_count()
+
+def band_values(value: int, bands: int) -> List[int]:
+    """Split a fingerprint into LSH bands. Two fingerprints within distance < bands share at least one band."""
+    width = BITS // bands
+    out = []
+    for i in range(bands):
+        # the last band takes any leftover bits
+        bits = width if i < bands - 1 else BITS - width * (bands - 1)
+        out.append((value >> (i * width)) & ((1 << bits) - 1))
+    return out
+
+def to_signed(value: int) -> int:
+    """Store an unsigned 64-bit fingerprint in a signed BIGINT column"""
+    return value - (1 << BITS) if value >= (1 << (BITS - 1)) else value
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << BITS) if value < 0 else value
@@ -1,74 +1,275 @@
 # backend/celery_app.py
+import random
+import time
 from celery import Celery
-from app.config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
+from celery.signals import before_task_publish, task_prerun
+from kombu import Exchange, Queue
+from app.config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, SYNC_INTERVAL_SECONDS, INTERACTIVE_SLO_SECONDS
+from app.services.rate_limiter import RateLimited, backoff_delay
 
 celery_app = Celery("inboxgenie", broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
 
+# Rate-limited tasks go back on the schedule instead of sleeping in a worker
+RATE_LIMIT_MAX_RETRIES = 8
+
+# Queue topology. Each queue is consumed by its own worker pool (see docker-compose.yml),
+# so a saturated bulk backlog can never delay interactive work:
+#   interactive - AI work a user is waiting for        (-c 4, prefetch 1)
+#   send        - outbox delivery                      (-c 4, prefetch 1)
+#   sync        - mailbox sync from Gmail              (-c 2, prefetch 1)
+#   bulk        - backlog enrichment and housekeeping  (-c 2, prefetch 4)
+# Within a queue, priority 0 is served first (Redis transport semantics).
+QUEUE_INTERACTIVE = "interactive"
+QUEUE_SEND = "send"
+QUEUE_SYNC = "sync"
+QUEUE_BULK = "bulk"
+
+celery_app.conf.update(
+    task_queues=[
+        Queue(name, Exchange(name, type="direct"), routing_key=name)
+        for name in (QUEUE_INTERACTIVE, QUEUE_SEND, QUEUE_SYNC, QUEUE_BULK)
+    ],
+    task_default_queue=QUEUE_BULK,
+    task_routes={
+        "celery_app.classify_email_async": {"queue": QUEUE_INTERACTIVE, "priority": 0},
+        "celery_app.summarize_email_async": {"queue": QUEUE_INTERACTIVE, "priority": 0},
+        "celery_app.send_outbox_message": {"queue": QUEUE_SEND, "priority": 0},
+        "celery_app.dispatch_outbox": {"queue": QUEUE_SEND, "priority": 5},
+        "celery_app.sync_user_inbox": {"queue": QUEUE_SYNC, "priority": 3},
+        "celery_app.fetch_all_users_inboxes": {"queue": QUEUE_SYNC, "priority": 5},
+        "celery_app.precompute_replies_async": {"queue": QUEUE_INTERACTIVE, "priority": 5},
+        "celery_app.process_new_emails_async": {"queue": QUEUE_BULK, "priority": 5},
+        "celery_app.embed_new_emails_async": {"queue": QUEUE_BULK, "priority": 7},
+        "celery_app.apply_retention": {"queue": QUEUE_BULK, "priority": 9},
+        "celery_app.rebuild_counters": {"queue": QUEUE_BULK, "priority": 9},
+    },
+    broker_transport_options={
+        "priority_steps": list(range(10)),
+        "sep": ":",
+        "queue_order_strategy": "priority",
+    },
+    # Long AI calls: take one message at a time and ack after completion so a slow
+    # task never holds a prefetched interactive message hostage
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+)
+
+celery_app.conf.beat_schedule = {
+    "sync-inboxes": {
+        "task": "celery_app.fetch_all_users_inboxes",
+        "schedule": SYNC_INTERVAL_SECONDS,
+    },
+    "process-new-emails": {
+        "task": "celery_app.process_new_emails_async",
+        "schedule": 120.0,
+    },
+    "dispatch-outbox": {
+        "task": "celery_app.dispatch_outbox",
+        "schedule": 60.0,
+    },
+    "embed-new-emails": {
+        "task": "celery_app.embed_new_emails_async",
+        "schedule": 60.0,
+    },
+    "email-retention": {
+        "task": "celery_app.apply_retention",
+        "schedule": 24 * 3600.0,
+    },
+    "rebuild-counters": {
+        "task": "celery_app.rebuild_counters",
+        "schedule": 24 * 3600.0,
+    },
+}
+
+@before_task_publish.connect
+def _stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+@task_prerun.connect
+def _record_queue_wait(task=None, **kwargs):
+    """Track how long tasks waited in their queue and count interactive SLO misses"""
+    from app.utils import metrics
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None) or (request.headers or {}).get("enqueued_at")
+    queue = (request.delivery_info or {}).get("routing_key") or QUEUE_BULK
+    if not enqueued_at or request.retries:
+        # retries wait for their countdown on purpose; that is not queueing delay
+        return
+    wait_ms = int(max(0.0, time.time() - float(enqueued_at)) * 1000)
+    metrics.incr(f"queue.{queue}.tasks")
+    metrics.incr(f"queue.{queue}.wait_ms_total", wait_ms)
+    if queue == QUEUE_INTERACTIVE and wait_ms > INTERACTIVE_SLO_SECONDS * 1000:
+        metrics.incr(f"queue.{queue}.slo_breaches")
+
+def _retry_countdown(exc: RateLimited) -> float:
+    # spread retries so throttled tasks don't all wake up at the same instant
+    return exc.retry_after + random.uniform(0, 1)
+
 @celery_app.task
 def fetch_all_users_inboxes():
+    from app.database import SessionLocal
+    from app.models import User
+    db = SessionLocal()
+    try:
+        user_ids = [uid for (uid,) in db.query(User.id).all()]
+    finally:
+        db.close()
+    # one task per user so a throttled mailbox doesn't hold up the others
+    for uid in user_ids:
+        sync_user_inbox.delay(uid)
+    return {"success": True, "queued_users": len(user_ids)}
+
+@celery_app.task(bind=True, max_retries=RATE_LIMIT_MAX_RETRIES)
+def sync_user_inbox(self, user_id: int, max_results: int = 10):
+    """Fetch and store the latest inbox messages for one user"""
     from app.database import SessionLocal
     from app.models import User
     from app.services.gmail_service import GmailService
     db = SessionLocal()
     try:
-        users = db.query(User).all()
-        for u in users:
-            GmailService(u).fetch_and_store_inbox(db, u, max_results=10)
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            return {"success": False, "error": "User not found"}
+        saved = GmailService(user).fetch_and_store_inbox(db, user, max_results=max_results)
+        return {"success": True, "user_id": user_id, "saved_count": len(saved)}
+    except RateLimited as exc:
+        db.rollback()
+        raise self.retry(exc=exc, countdown=_retry_countdown(exc))
     finally:
         db.close()
 
-@celery_app.task
-def classify_email_async(email_id: int):
+@celery_app.task(bind=True, max_retries=RATE_LIMIT_MAX_RETRIES)
+def classify_email_async(self, user_id: int, email_id: int):
     """Asynchronously classify an email using AI"""
+    from app.config import NEAR_DUPLICATE_REUSE
     from app.database import SessionLocal
     from app.models import Email
     from app.services.ai_service import ai_service
+    from app.services import counters
+    from app.services.near_duplicates import reuse_classification
+    from app.utils import metrics
     from app.utils.crypto import encrypt_data
     
     db = SessionLocal()
     try:
-        email = db.query(Email).filter(Email.id == email_id).first()
+        email = db.query(Email).filter(Email.user_id == user_id, Email.id == email_id).first()
         if not email:
             return {"success": False, "error": "Email not found"}
         
-        # Prepare email data for classification
-        email_data = {
-            "subject": email.subject or "",
-            "content": email.snippet or "",
-            "snippet": email.snippet or ""
-        }
-        
-        # Classify the email
-        result = ai_service.classify(email_data)
+        # Templated mail (receipts, digests, alerts) reuses a near-duplicate's classification
+        result = reuse_classification(db, email) if NEAR_DUPLICATE_REUSE else None
+        reused_from = result.get("reused_from") if result else None
+        if result:
+            metrics.incr("ai.classify.near_duplicate_hits")
+        else:
+            # Prepare email data for classification
+            email_data = {
+                "subject": email.subject or "",
+                "content": email.snippet or "",
+                "snippet": email.snippet or ""
+            }
+            
+            # Classify the email
+            result = ai_service.classify(email_data, fallback_on_limit=False)
+            if result.get("source") == "model":
+                metrics.incr("ai.classify.model_calls")
         
         # Store the encrypted classification result
         if result and "label" in result:
-            encrypted_classification = encrypt_data(str(result))
+            # reused labels only ever come from model-classified rows
+            source = "model" if reused_from else result.get("source", "model")
+            encrypted_classification = encrypt_data(str({"label": result["label"], "score": result["score"], "source": source}))
+            before = counters.snapshot(email)
             email.ai_classification_enc = encrypted_classification
+            email.classification_source = source
+            email.category = result["label"]
             
             # Update spam status based on classification
             if result["label"] == "SPAM":
                 email.is_spam = True
             
+            counters.apply_change(db, email.user_id, before, counters.snapshot(email))
             db.commit()
             
+            # Draft replies ahead of time for mail the user is likely to answer
+            if result["label"] == "IMPORTANT" and _should_precompute_replies(email):
+                precompute_replies_async.delay(user_id, email_id)
+            
             return {
                 "success": True, 
                 "email_id": email_id,
                 "classification": result["label"],
-                "confidence": result["score"]
+                "confidence": result["score"],
+                "reused_from": reused_from
             }
         else:
             return {"success": False, "error": "Classification failed"}
             
+    except RateLimited as exc:
+        db.rollback()
+        raise self.retry(exc=exc, countdown=_retry_countdown(exc))
     except Exception as e:
         db.rollback()
         return {"success": False, "error": str(e)}
     finally:
         db.close()
 
-@celery_app.task
-def summarize_email_async(email_id: int):
+def _should_precompute_replies(email) -> bool:
+    from app.config import SMART_REPLY_PRECOMPUTE
+    from app.services.ai_service import ai_service
+    from app.services.reply_precompute import has_slot
+    if not SMART_REPLY_PRECOMPUTE or ai_service.client is None:
+        return False
+    if email.ai_replies_enc or email.status != "inbox":
+        return False
+    # the slot itself is only taken once replies are stored, so failed runs don't use up the cap
+    return has_slot(email.user_id)
+
+@celery_app.task(bind=True, max_retries=RATE_LIMIT_MAX_RETRIES)
+def precompute_replies_async(self, user_id: int, email_id: int):
+    """Generate and store smart replies for an email before the user opens the composer"""
+    from app.database import SessionLocal
+    from app.models import Email
+    from app.services.ai_service import ai_service
+    from app.services.reply_precompute import has_slot, reply_source_text, reserve_slot, store_replies
+
+    db = SessionLocal()
+    try:
+        email = db.query(Email).filter(Email.user_id == user_id, Email.id == email_id).first()
+        if not email:
+            return {"success": False, "error": "Email not found"}
+        if email.ai_replies_enc or not has_slot(user_id):
+            return {"success": True, "email_id": email_id, "skipped": True}
+
+        # fallback=False: any model failure raises, so generic canned replies are never stored
+        text = reply_source_text(email)
+        smart_replies = ai_service.generate_smart_reply(text, fallback=False)
+        auto_reply = ai_service.generate_auto_reply(text, fallback=False)
+        if not smart_replies or not auto_reply:
+            return {"success": False, "email_id": email_id, "error": "Model returned no replies"}
+        if not reserve_slot(user_id):
+            # other precomputations for this user filled the cap while this one ran
+            return {"success": True, "email_id": email_id, "skipped": True}
+        store_replies(email, smart_replies, auto_reply)
+        db.commit()
+        return {"success": True, "email_id": email_id, "reply_count": len(smart_replies)}
+    except RateLimited as exc:
+        db.rollback()
+        raise self.retry(exc=exc, countdown=_retry_countdown(exc))
+    except TimeoutError as exc:
+        db.rollback()
+        raise self.retry(exc=exc, countdown=backoff_delay(self.request.retries))
+    except Exception as e:
+        # nothing stored; the composer generates replies live for this email
+        db.rollback()
+        return {"success": False, "error": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task(bind=True, max_retries=RATE_LIMIT_MAX_RETRIES)
+def summarize_email_async(self, user_id: int, email_id: int):
     """Asynchronously summarize an email using AI"""
     from app.database import SessionLocal
     from app.models import Email
@@ -77,7 +278,7 @@ def summarize_email_async(email_id: int):
     
     db = SessionLocal()
     try:
-        email = db.query(Email).filter(Email.id == email_id).first()
+        email = db.query(Email).filter(Email.user_id == user_id, Email.id == email_id).first()
         if not email:
             return {"success": False, "error": "Email not found"}
         
@@ -85,7 +286,7 @@ def summarize_email_async(email_id: int):
         email_content = f"Subject: {email.subject or ''}\nContent: {email.snippet or ''}"
         
         # Generate summary
-        summary = ai_service.summarize(email_content)
+        summary = ai_service.summarize(email_content, fallback_on_limit=False)
         
         if summary:
             # Store the encrypted summary
@@ -101,6 +302,9 @@ def summarize_email_async(email_id: int):
         else:
             return {"success": False, "error": "Summarization failed"}
             
+    except RateLimited as exc:
+        db.rollback()
+        raise self.retry(exc=exc, countdown=_retry_countdown(exc))
     except Exception as e:
         db.rollback()
         return {"success": False, "error": str(e)}
@@ -108,25 +312,38 @@ def summarize_email_async(email_id: int):
         db.close()
 
 @celery_app.task
-def process_new_emails_async():
-    """Process all new emails with AI classification and summarization"""
+def process_new_emails_async(queue: str = QUEUE_BULK):
+    """Process all new emails with AI classification and summarization.
+
+    The periodic run enqueues the backlog on the bulk queue; a run the user asked for
+    (POST /ai/process-emails) passes QUEUE_INTERACTIVE so the work is picked up right away.
+    """
+    from datetime import datetime, timedelta
+    from sqlalchemy import or_
+    from app.config import AI_REQUEUE_AFTER_SECONDS
     from app.database import SessionLocal
     from app.models import Email
     
     db = SessionLocal()
     try:
-        # Find emails that haven't been processed yet
+        # Find emails that haven't been processed yet and aren't already waiting in the queue
+        now = datetime.utcnow()
         unprocessed_emails = db.query(Email).filter(
-            Email.ai_classification_enc.is_(None)
+            Email.ai_classification_enc.is_(None),
+            or_(Email.ai_queued_at.is_(None),
+                Email.ai_queued_at < now - timedelta(seconds=AI_REQUEUE_AFTER_SECONDS)),
         ).limit(50).all()
+        # Mark before publishing: a crash in between only delays the rows until the requeue window
+        for email in unprocessed_emails:
+            email.ai_queued_at = now
+        db.commit()
         
         results = []
         for email in unprocessed_emails:
-            # Queue classification task
-            classify_task = classify_email_async.delay(email.id)
+            priority = 0 if queue == QUEUE_INTERACTIVE else 5
+            classify_task = classify_email_async.apply_async((email.user_id, email.id), queue=queue, priority=priority)
             
-            # Queue summarization task
-            summarize_task = summarize_email_async.delay(email.id)
+            summarize_task = summarize_email_async.apply_async((email.user_id, email.id), queue=queue, priority=priority)
             
             results.append({
                 "email_id": email.id,
@@ -141,6 +358,131 @@ def process_new_emails_async():
         }
         
     except Exception as e:
+        db.rollback()
         return {"success": False, "error": str(e)}
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Retries are bounded by the row's persisted attempt count (outbox_service.MAX_ATTEMPTS), not by
+# this task's retry counter, which restarts whenever dispatch_outbox re-queues a row
+@celery_app.task(bind=True, max_retries=None)
+def send_outbox_message(self, outbox_id: int):
+    """Deliver one outbox row through Gmail; each row is claimed so it is sent at most once"""
+    from app.database import SessionLocal
+    from app.services import outbox_service
+
+    db = SessionLocal()
+    try:
+        row = outbox_service.claim(db, outbox_id)
+        if row is None:
+            return {"success": False, "error": "Message is not pending"}
+        try:
+            outbox_service.deliver(db, row)
+        except Exception as exc:
+            db.rollback()
+            if isinstance(exc, RateLimited):
+                # quota pressure is temporary and never sent anything; always wait it out
+                final, countdown = False, _retry_countdown(exc)
+            else:
+                final, countdown = outbox_service.should_give_up(row, exc), backoff_delay(row.attempts - 1)
+            outbox_service.release(db, outbox_id, str(exc), final=final, retry_in=countdown)
+            if final:
+                return {"success": False, "outbox_id": outbox_id, "error": str(exc)}
+            raise self.retry(exc=exc, countdown=countdown)
+        return {"success": True, "outbox_id": outbox_id, "message_id": row.gmail_message_id}
+    finally:
+        db.close()
+
+@celery_app.task
+def dispatch_outbox():
+    """Re-queue outbox rows whose task was lost or whose worker died mid-send"""
+    from app.database import SessionLocal
+    from app.services import outbox_service
+
+    db = SessionLocal()
+    try:
+        ids = [oid for (oid,) in outbox_service.find_undispatched(db)]
+    finally:
+        db.close()
+    for oid in ids:
+        send_outbox_message.delay(oid)
+    return {"success": True, "dispatched_count": len(ids)}
+
+EMBEDDER_KEY = "embeddings:active_key"
+
+@celery_app.task
+def embed_new_emails_async(limit: int = 500):
+    """Embed emails that have no vector in the current embedding space yet"""
+    from collections import defaultdict
+    from app.database import SessionLocal
+    from app.models import Email
+    from app.services.embeddings import get_embedder, embedder_key, email_text
+    from app.services.vector_index import VectorIndex
+    from app.utils.redis_client import get_redis
+
+    embedder = get_embedder()
+    key = embedder_key(embedder)
+    db = SessionLocal()
+    try:
+        # A backend change invalidates every vector: clear the markers once, so the regular poll
+        # only ever reads the small "embedded_with IS NULL" partial index
+        if get_redis().get(EMBEDDER_KEY) != key:
+            db.query(Email).filter(
+                Email.embedded_with.isnot(None), Email.embedded_with != key
+            ).update({"embedded_with": None, "updated_at": Email.updated_at}, synchronize_session=False)
+            db.commit()
+            get_redis().set(EMBEDDER_KEY, key)
+
+        emails = db.query(Email).filter(
+            Email.embedded_with.is_(None)
+        ).order_by(Email.user_id, Email.id).limit(limit).all()
+
+        by_user = defaultdict(list)
+        for email in emails:
+            by_user[email.user_id].append(email)
+
+        for user_id, rows in by_user.items():
+            vectors = embedder.embed([email_text(e) for e in rows])
+            VectorIndex(user_id, embedder).add([e.id for e in rows], vectors)
+            for e in rows:
+                e.embedded_with = key
+            db.commit()
+
+        return {"success": True, "embedded_count": len(emails)}
+    except Exception as e:
+        db.rollback()
+        return {"success": False, "error": str(e)}
+    finally:
+        db.close()
+
+@celery_app.task
+def apply_retention():
+    """Move old trashed/archived mail to cold storage and purge expired cold mail"""
+    from app.database import SessionLocal
+    from app.services.retention import run_retention
+
+    db = SessionLocal()
+    try:
+        return {"success": True, **run_retention(db)}
+    finally:
+        db.close()
+
+@celery_app.task
+def rebuild_counters():
+    """Recompute every user's mailbox counters to correct any drift"""
+    from app.database import SessionLocal
+    from app.models import User
+    from app.services import counters
+
+    db = SessionLocal()
+    try:
+        user_ids = [uid for (uid,) in db.query(User.id).all()]
+        for uid in user_ids:
+            counters.rebuild(db, uid)
+            db.commit()
+        return {"success": True, "users": len(user_ids)}
+    except Exception as e:
+        db.rollback()
+        return {"success": False, "error": str(e)}
+    finally:
+        db.close()
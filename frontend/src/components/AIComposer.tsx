@@ -10,6 +10,7 @@ import { rewriteEmailTone, generateAutoReply, generateSmartReplies, sendEmail }
 interface AIComposerProps {
   replyToEmail?: {
     id: string;
+    messageId?: string;
     sender: string;
     subject: string;
     content: string;
@@ -92,7 +93,7 @@ export default function AIComposer({ replyToEmail, onClose }: AIComposerProps) {
     setIsAutoReplying(true);
     try {
       const originalEmailText = `Subject: ${replyToEmail.subject}\nFrom: ${replyToEmail.sender}\nContent: ${replyToEmail.content}`;
-      const response = await generateAutoReply(originalEmailText);
+      const response = await generateAutoReply(originalEmailText, "", replyToEmail.messageId);
       if (response.success) {
         setMessage(response.reply);
       } else {
@@ -115,7 +116,7 @@ export default function AIComposer({ replyToEmail, onClose }: AIComposerProps) {
     setIsSmartReplying(true);
     try {
       const originalEmailText = `Subject: ${replyToEmail.subject}\nFrom: ${replyToEmail.sender}\nContent: ${replyToEmail.content}`;
-      const response = await generateSmartReplies(originalEmailText);
+      const response = await generateSmartReplies(originalEmailText, replyToEmail.messageId);
       if (response.success) {
         setSmartReplies(response.replies);
       } else {
@@ -49,6 +49,7 @@ function Dashboard({ onLogout }: DashboardProps) {
       // Transform backend data to match our Email interface
       const emailsWithFeatures: Email[] = data.map((email: any) => ({
         id: email.id ? email.id.toString() : Math.random().toString(),
+        messageId: email.message_id,
         sender: email.sender || "Unknown Sender",
         subject: email.subject || "No Subject",
         snippet: email.snippet || "No snippet available",
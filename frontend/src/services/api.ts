@@ -39,6 +39,7 @@ export async function fetchEmails(): Promise<any[]> {
 // --- TYPE DEFINITIONS ---
 export interface Email {
   id: string; 
+  messageId?: string; // Gmail message id
   sender: string;
   subject: string;
   snippet: string;
@@ -82,11 +83,13 @@ export async function rewriteEmailTone(text: string, tone: string) {
   }
 }
 
-export async function generateAutoReply(originalEmail: string, context?: string) {
+export async function generateAutoReply(originalEmail: string, context?: string, emailId?: string) {
   try {
+    // emailId (Gmail message id) lets the backend serve replies drafted ahead of time
     const response = await api.post("/ai/auto-reply", { 
       original_email: originalEmail, 
-      context: context || "" 
+      context: context || "",
+      email_id: emailId
     });
     return response.data;
   } catch (error) {
@@ -95,9 +98,9 @@ export async function generateAutoReply(originalEmail: string, context?: string)
   }
 }
 
-export async function generateSmartReplies(text: string) {
+export async function generateSmartReplies(text: string, emailId?: string) {
   try {
-    const response = await api.post("/ai/smart-reply", { text });
+    const response = await api.post("/ai/smart-reply", { text, email_id: emailId });
     return response.data;
   } catch (error) {
     console.error("Error generating smart replies:", error);